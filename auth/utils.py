@@ -1,9 +1,13 @@
 import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 import bcrypt
 from dotenv import load_dotenv
+from services.cache import TTLCache
 
 load_dotenv()
 
@@ -11,13 +15,58 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
 
+# bcrypt work factor for new hashes; existing hashes are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads doing bcrypt work (bcrypt releases the GIL), and how many callers may wait for one
+BCRYPT_MAX_WORKERS = int(os.getenv("BCRYPT_MAX_WORKERS", "4"))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "100"))
+# Verified token payloads, so the same token is not HMAC-checked on every request
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+_bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_MAX_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_slots = asyncio.Semaphore(BCRYPT_MAX_WORKERS)
+_bcrypt_waiting = 0
+_decoded_tokens = TTLCache(maxsize=TOKEN_CACHE_SIZE)
+
+class PasswordHashingBusy(Exception):
+    """Raised when too many password operations are already queued."""
+
 def verify_password(plain_password, hashed_password):
     if not hashed_password:
         return False
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def needs_rehash(hashed_password: str):
+    """True when the stored hash was made with a different work factor than BCRYPT_ROUNDS."""
+    try:
+        # Format: $2b$<rounds>$<salt+hash>
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (AttributeError, IndexError, ValueError):
+        return False
+
+async def _run_bcrypt(func, *args):
+    """Run a bcrypt call on the worker pool; callers beyond the pool queue up to BCRYPT_MAX_QUEUE."""
+    global _bcrypt_waiting
+    if _bcrypt_slots.locked() and _bcrypt_waiting >= BCRYPT_MAX_QUEUE:
+        raise PasswordHashingBusy()
+    _bcrypt_waiting += 1
+    try:
+        await _bcrypt_slots.acquire()
+    finally:
+        _bcrypt_waiting -= 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_bcrypt_executor, func, *args)
+    finally:
+        _bcrypt_slots.release()
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_bcrypt(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_bcrypt(get_password_hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -30,8 +79,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def decode_access_token(token: str):
+    payload = _decoded_tokens.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    # Entries expire together with the token itself
+    ttl = payload["exp"] - time.time() if "exp" in payload else None
+    _decoded_tokens.set(token, payload, ttl=ttl)
+    return payload
+
+def token_cache_stats():
+    return _decoded_tokens.stats()
@@ -0,0 +1,70 @@
+"""
+Event-loop latency under concurrent logins: inline bcrypt vs the bcrypt thread pool.
+
+A probe task sleeps 10ms in a loop and records how late it wakes up; that lag is
+what every other request on the worker would see.
+
+    python -m benchmarks.bench_bcrypt_loop [--logins 20] [--rounds 12]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROBE_INTERVAL = 0.01
+
+
+async def probe_loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((time.perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+
+async def run(label: str, login, logins: int):
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(probe_loop_lag(stop, lags))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(
+        f"{label:<10} logins={logins} total={elapsed:.2f}s "
+        f"loop lag p50={statistics.median(lags) if lags else 0:.1f}ms p99={p99:.1f}ms max={max(lags, default=0):.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    from auth import utils
+
+    hashed = utils.get_password_hash("correct horse battery staple")
+
+    async def inline_login():
+        utils.verify_password("correct horse battery staple", hashed)
+
+    async def pooled_login():
+        await utils.verify_password_async("correct horse battery staple", hashed)
+
+    await run("inline", inline_login, args.logins)
+    await run("pooled", pooled_login, args.logins)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+"""
+Email throughput: a new SMTP connection per message (the old send_email) vs the
+pooled transport, against a local debugging SMTP server.
+
+The server sleeps --handshake-ms when a connection opens, standing in for the
+TLS handshake + AUTH round-trips of a real provider. Event-loop lag is sampled
+the same way as in bench_bcrypt_loop.
+
+    python -m benchmarks.bench_smtp [--messages 200] [--handshake-ms 150] [--pool 3]
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import socketserver
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROBE_INTERVAL = 0.01
+
+
+class DebugSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail: every message is read and dropped."""
+
+    def reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        time.sleep(self.server.handshake)
+        self.reply("220 localhost debugging server")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.wfile.write(b"250-localhost\r\n250 8BITMIME\r\n")
+            elif command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.server.received += 1
+                self.reply("250 OK")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                # HELO / MAIL / RCPT / NOOP / RSET
+                self.reply("250 OK")
+
+
+def start_server(handshake: float):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), DebugSMTPHandler)
+    server.daemon_threads = True
+    server.handshake = handshake
+    server.received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def probe_loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((time.perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+
+async def run(label: str, send_all, messages: int):
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(probe_loop_lag(stop, lags))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    sent = await send_all()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(
+        f"{label:<12} sent={sum(sent)}/{messages} total={elapsed:.2f}s rate={messages / elapsed:.1f} msg/s "
+        f"loop lag p50={statistics.median(lags) if lags else 0:.1f}ms p99={p99:.1f}ms max={max(lags, default=0):.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--handshake-ms", type=float, default=150)
+    parser.add_argument("--pool", type=int, default=3)
+    args = parser.parse_args()
+
+    server = start_server(args.handshake_ms / 1000)
+    host, port = server.server_address
+    from services.email_service import SMTPPool, build_message
+
+    emails = [
+        build_message(f"user{i}@example.com", f"Reminder {i}", f"Your Task 'Item {i}' starts soon.")
+        for i in range(args.messages)
+    ]
+
+    async def per_message():
+        # The old behaviour: connect, send, quit - inline on the event loop
+        results = []
+        for msg in emails:
+            smtp = smtplib.SMTP(host, port)
+            smtp.send_message(msg, from_addr="bench@example.com")
+            smtp.quit()
+            results.append(True)
+        return results
+
+    def pool():
+        return SMTPPool(host, port, size=args.pool, starttls=False)
+
+    async def pooled_concurrent():
+        p = pool()
+        try:
+            return await asyncio.gather(*(p.send_async(msg) for msg in emails))
+        finally:
+            p.close()
+
+    async def pooled_batch():
+        p = pool()
+        try:
+            chunk = -(-len(emails) // args.pool)
+            batches = [emails[i:i + chunk] for i in range(0, len(emails), chunk)]
+            loop = asyncio.get_running_loop()
+            results = await asyncio.gather(*(loop.run_in_executor(p.executor, p.send_many, batch) for batch in batches))
+            return [ok for batch in results for ok in batch]
+        finally:
+            p.close()
+
+    for msg in emails:
+        msg.replace_header("From", "bench@example.com")
+
+    await run("per-message", per_message, args.messages)
+    await run("pooled", pooled_concurrent, args.messages)
+    await run("send_many", pooled_batch, args.messages)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+"""
+WhatsApp throughput: one blocking HTTPS request per message (the old
+send_whatsapp_message, inline on the event loop) vs the production path -
+`enqueue_whatsapp` into the outbox, workers claiming the jobs and handing them to
+the dispatcher - against a local fake of Twilio's Messages resource.
+
+The fake server sleeps --latency-ms per request, standing in for the round-trip
+to Twilio. --recipients controls how many distinct numbers the messages go to, so
+bursts to the same number show the merge window at work. The outbox runs twice:
+with at most --workers jobs held by the dispatcher (what parking a worker per send
+amounts to) and with the configured OUTBOX_WHATSAPP_IN_FLIGHT. Event-loop lag is
+sampled the same way as in bench_smtp.
+
+Needs MONGO_URL / DB_NAME; jobs go to a throwaway bench_outbox_<pid> collection
+that is dropped afterwards.
+
+    python -m benchmarks.bench_whatsapp [--messages 200] [--recipients 20] [--latency-ms 80] [--rate 50] [--workers 4]
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROBE_INTERVAL = 0.01
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    """Accepts Messages.json POSTs and answers with a message sid."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        self.server.received += 1
+        body = json.dumps({"sid": f"SM{self.server.received:032d}", "status": "queued"}).encode()
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops concurrent connects into 1s SYN retries
+    request_queue_size = 128
+
+
+def start_server(latency: float):
+    server = FakeTwilioServer(("127.0.0.1", 0), FakeTwilioHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def probe_loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((time.perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+
+async def run(label: str, send_all, server, messages: int):
+    stop = asyncio.Event()
+    lags = []
+    before = server.received
+    probe = asyncio.create_task(probe_loop_lag(stop, lags))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    sent = await send_all()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(
+        f"{label:<12} delivered={sum(sent)}/{messages} requests={server.received - before} "
+        f"total={elapsed:.2f}s rate={messages / elapsed:.1f} msg/s "
+        f"loop lag p50={statistics.median(lags) if lags else 0:.1f}ms p99={p99:.1f}ms max={max(lags, default=0):.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--recipients", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--rate", type=float, default=50)
+    parser.add_argument("--merge-window-ms", type=float, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    server = start_server(args.latency_ms / 1000)
+    host, port = server.server_address
+    from database import db
+    from services import outbox, whatsapp_dispatcher
+    from services.indexes import INDEX_REGISTRY
+    from services.whatsapp_dispatcher import TwilioHTTPTransport, WhatsAppDispatcher
+
+    configured_in_flight = outbox.OUTBOX_WHATSAPP_IN_FLIGHT
+    sid = "ACbench"
+    path = f"/2010-04-01/Accounts/{sid}/Messages.json"
+    messages = [
+        (f"whatsapp:+1555000{i % args.recipients:04d}", f"*Reminder*\nYour Task 'Item {i}' starts in 20 minutes.")
+        for i in range(args.messages)
+    ]
+
+    async def per_message():
+        # The old behaviour: a fresh blocking request per message, on the event loop
+        results = []
+        for to_number, text in messages:
+            conn = http.client.HTTPConnection(host, port)
+            conn.request("POST", path, urlencode({"From": "whatsapp:+10000000000", "To": to_number, "Body": text}),
+                         {"Content-Type": "application/x-www-form-urlencoded"})
+            results.append(conn.getresponse().status == 201)
+            conn.close()
+        return results
+
+    async def through_outbox(held: int):
+        coll = db[f"bench_outbox_{os.getpid()}"]
+        await coll.create_indexes(INDEX_REGISTRY["notification_outbox"])
+        outbox.notification_outbox_collection = coll
+        outbox.OUTBOX_WHATSAPP_IN_FLIGHT = held
+        transport = TwilioHTTPTransport(sid, "token", "whatsapp:+10000000000", api_base=f"http://{host}:{port}")
+        whatsapp_dispatcher._dispatcher = WhatsAppDispatcher(
+            transport, rate=args.rate, burst=int(args.rate), merge_window_ms=args.merge_window_ms
+        )
+        before = dict(outbox._counts)
+        try:
+            await asyncio.gather(*(outbox.enqueue_whatsapp(to_number, text) for to_number, text in messages))
+            outbox.start_workers(args.workers)
+            while True:
+                sent = outbox._counts["sent"] - before["sent"]
+                dead = outbox._counts["dead"] - before["dead"]
+                if sent + dead >= len(messages):
+                    return [True] * sent + [False] * dead
+                await asyncio.sleep(0.01)
+        finally:
+            stats = whatsapp_dispatcher.dispatcher_stats()
+            await outbox.stop_workers()
+            await whatsapp_dispatcher.close_dispatcher()
+            await coll.drop()
+            print(f"{'':<12} held<={held} merged={stats['merged']} retried={outbox._counts['retried'] - before['retried']} "
+                  f"latency p50={stats['latency_ms']['p50']}ms p95={stats['latency_ms']['p95']}ms")
+
+    await run("per-message", per_message, server, args.messages)
+    for held in (args.workers, configured_in_flight):
+        await run(f"outbox-{held}", lambda: through_outbox(held), server, args.messages)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
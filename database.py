@@ -29,3 +29,7 @@ notes_collection = db.notes
 alerts_log_collection = db.alerts_log
 credentials_collection = db.credentials
 plans_collection = db.plans
+activities_collection = db.activities # Unified store, see services/activity_store.py
+task_locator_collection = db.task_locator # activity _id -> owning collection
+daily_rollups_collection = db.daily_rollups # per (user_id, date, category) counters
+notification_outbox_collection = db.notification_outbox # queued email / WhatsApp jobs, see services/outbox.py
@@ -1,7 +1,12 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from routes import users, tasks, notes, ai_chatbot, stats, habits, credentials
+from fastapi.responses import JSONResponse
+from routes import users, tasks, notes, ai_chatbot, stats, habits, credentials, admin
 from services.scheduler import start_scheduler
+from services.indexes import ensure_indexes
+from services import outbox, reminders
+from services.whatsapp_dispatcher import close_dispatcher
+from auth.utils import PasswordHashingBusy
 import uvicorn
 import os
 
@@ -32,11 +37,28 @@ app.include_router(ai_chatbot.router)
 app.include_router(stats.router)
 app.include_router(habits.router)
 app.include_router(credentials.router)
+app.include_router(admin.router)
+
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    # Login storm: shed load instead of letting the bcrypt queue grow without bound
+    return JSONResponse(status_code=503, content={"detail": "Server is busy, please retry"}, headers={"Retry-After": "1"})
 
 @app.on_event("startup")
 async def startup_event():
+    # Make sure every query path is backed by an index
+    await ensure_indexes()
     # Start the background task scheduler
     start_scheduler()
+    # Deliver queued email / WhatsApp notifications
+    outbox.start_workers()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Unfinished jobs keep their lease and are retried once it expires
+    await reminders.stop()
+    await outbox.stop_workers()
+    await close_dispatcher()
 
 @app.get("/")
 @app.head("/")
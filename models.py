@@ -74,6 +74,7 @@ class NoteResponse(NoteBase):
 class AIChatRequest(BaseModel):
     text: str
     image: Optional[str] = None  # Base64 encoded image
+    execute_actions: bool = False  # Apply returned actions server-side (see action_results)
 
 class AIChatResponse(BaseModel):
     reply: str
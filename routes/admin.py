@@ -0,0 +1,45 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException, status
+from routes.users import get_current_user, user_cache_stats
+from services.indexes import audit_indexes
+from auth.utils import token_cache_stats
+from services import stats_cache, task_locator, ai_context, intent_router, outbox, reminders
+from services.ai_service import response_cache_stats
+from services.email_service import smtp_pool
+from services.whatsapp_dispatcher import dispatcher_stats
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+# Comma separated list of emails allowed to use the admin endpoints
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user.get("email", "").lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+@router.get("/indexes")
+async def get_index_report(current_user: dict = Depends(require_admin)):
+    """Missing / undeclared / unused indexes per collection (usage from $indexStats)."""
+    return await audit_indexes()
+
+@router.get("/metrics")
+async def get_metrics(current_user: dict = Depends(require_admin)):
+    """In-process cache, AI routing and transport counters for this worker."""
+    return {
+        "stats_cache": stats_cache.cache_stats(),
+        "task_locator_cache": task_locator.cache_stats(),
+        "user_cache": user_cache_stats(),
+        "token_cache": token_cache_stats(),
+        "ai_response_cache": response_cache_stats(),
+        "ai_context_cache": ai_context.context_cache_stats(),
+        "ai_intent_router": intent_router.router_stats(),
+        "smtp_pool": smtp_pool.pool_stats(),
+        "whatsapp": dispatcher_stats(),
+        "reminders": reminders.reminder_stats(),
+    }
+
+@router.get("/outbox")
+async def get_outbox_metrics(current_user: dict = Depends(require_admin)):
+    """Notification queue depth per status and this worker's delivery counters."""
+    return await outbox.queue_stats()
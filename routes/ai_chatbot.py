@@ -1,71 +1,237 @@
-from fastapi import APIRouter, Depends
-from services.ai_service import process_user_input
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from services.ai_service import process_user_input, stream_user_input, response_cache_key, get_cached_response
+from services import schedule_version, ai_context, intent_router
 from models import AIChatRequest
 from routes.users import get_current_user
-from datetime import datetime, timedelta
-from database import (
-    tasks_collection, work_collection, 
-    meeting_collection, routine_collection,
-    personal_collection, credentials_collection
+from database import credentials_collection
+from services.ai_context import build_schedule_context
+from services.image_service import (
+    AI_IMAGE_MAX_BYTES, UPLOAD_FORM_OVERHEAD, ImageTooLarge, UnsupportedImage, MalformedUpload,
+    decode_base64_image, prepare_image, read_upload_form
 )
-from services.email_service import send_email
-from services.whatsapp_service import send_whatsapp_message
+from services.outbox import enqueue_email, enqueue_whatsapp
 from routes.credentials import fernet
+from services.action_executor import execute_actions
 import urllib.parse
+import asyncio
+import json
+import io
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
+# How often a pending AI call checks whether the client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+
+async def cancel_on_disconnect(http_request: Request, coro):
+    """Await `coro`, cancelling it if the client disconnects first. Returns None when cancelled."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print("DEBUG: Client disconnected, cancelling AI request")
+                task.cancel()
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+
 @router.post("/chat")
-async def chat(request: AIChatRequest, current_user: dict = Depends(get_current_user)):
-    user_id = str(current_user["_id"])
-    past_date = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
-    future_date = (datetime.now() + timedelta(days=365 * 2)).strftime("%Y-%m-%d")
-    
-    all_context_tasks = []
-    collections = [tasks_collection, work_collection, meeting_collection, routine_collection, personal_collection]
-    
-    for coll in collections:
-        cursor = coll.find({
-            "user_id": user_id,
-            "date": {"$gte": past_date, "$lte": future_date}
-        })
-        async for task in cursor:
-            task["id"] = str(task["_id"])
-            del task["_id"]
-            all_context_tasks.append(task)
-            
-    # Fetch and decrypt credentials for context
+async def chat(request: AIChatRequest, http_request: Request, current_user: dict = Depends(get_current_user)):
+    image = await prepared_image(request.image) if request.image else None
+    return await answer(request.text, http_request, current_user, image, request.execute_actions)
+
+async def route_locally(text: str, user_id: str, image: tuple = None):
+    """Intent router answer, or None when the model (or the response cache) is needed."""
+    return None if image else await intent_router.route(text, user_id, decrypt_password)
+
+def cached_reply(text: str, user_id: str, version: int, has_image: bool = False):
+    """(cache_key, cached result or None). Image requests are never cached."""
+    if has_image:
+        return None, None
+    cache_key = response_cache_key(user_id, text, version)
+    return cache_key, get_cached_response(cache_key)
+
+async def prepared_image(source):
+    """(bytes, mime) for the model from a base64 string or a file, as an HTTP error when unusable."""
+    try:
+        if isinstance(source, str):
+            source = io.BytesIO(decode_base64_image(source))
+        return await prepare_image(source)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except UnsupportedImage as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+
+async def load_credentials(user_id: str):
+    """The user's credentials for the prompt, passwords still encrypted (they are cached)."""
     all_context_credentials = []
     cursor_creds = credentials_collection.find({"user_id": user_id})
     async for cred in cursor_creds:
         cred["id"] = str(cred["_id"])
         del cred["_id"]
-        # Decrypt password for AI context
-        if "password" in cred and cred["password"]:
-            try:
-                cred["password"] = fernet.decrypt(cred["password"].encode()).decode()
-            except Exception:
-                pass
         all_context_credentials.append(cred)
-            
-    result = await process_user_input(request.text, all_context_tasks, all_context_credentials, request.image)
-    
+    return all_context_credentials
+
+async def load_context(user_id: str, text: str, version: int):
+    """Budgeted schedule context and credential block, reused per schedule version."""
+    # Detailed days that matter for this message + per-day counts, within the token budget
+    (schedule_context, context_info), credentials_context = await asyncio.gather(
+        build_schedule_context(user_id, text, version=version),
+        ai_context.credentials_context(user_id, lambda: load_credentials(user_id), decrypt_password, version)
+    )
+    print(f"DEBUG: AI schedule context for {user_id}: {context_info}")
+    return schedule_context, credentials_context
+
+async def generate_reply(text: str, http_request: Request, user_id: str, version: int, cache_key: tuple = None, image: tuple = None):
+    """Build the prompt context and ask the model. Returns None if the client went away."""
+    schedule_context, credentials_context = await load_context(user_id, text, version)
+    # Only requests that actually reach the model count as fallbacks, not cache hits
+    intent_router.record_llm_fallback()
+    return await cancel_on_disconnect(
+        http_request,
+        process_user_input(text, schedule_context=schedule_context, cache_key=cache_key,
+                           credentials_context=credentials_context, image=image)
+    )
+
+async def answer(text: str, http_request: Request, current_user: dict, image: tuple = None, execute: bool = False):
+    """Cached or freshly generated answer for one message, with dispatch actions handled (and the rest applied when `execute`)."""
+    user_id = str(current_user["_id"])
+
+    # Simple lookups are answered locally, without the model
+    routed = await route_locally(text, user_id, image)
+    if routed:
+        return await handle_actions(routed, current_user, execute)
+
+    # Same question against the same schedule/credentials version: reuse the answer
+    version = await schedule_version.current(user_id)
+    cache_key, result = cached_reply(text, user_id, version, image is not None)
+
+    if result is None:
+        result = await generate_reply(text, http_request, user_id, version, cache_key, image)
+        if result is None:
+            # Nobody is waiting for the answer - skip the dispatch side effects too
+            return {"reply": "", "actions": []}
+    else:
+        print(f"DEBUG: AI response cache hit for {user_id}")
+
+    return await handle_actions(result, current_user, execute)
+
+@router.post("/chat/upload")
+async def chat_upload(http_request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Multipart variant of /chat for photos: fields `text` and `image` (file).
+    The image is size-limited, type-checked from its content and downscaled before the model sees it.
+    """
+    # Refuse oversized bodies before reading them; chunked ones are cut off mid-stream
+    content_length = http_request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > AI_IMAGE_MAX_BYTES + UPLOAD_FORM_OVERHEAD:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Upload too large")
+
+    try:
+        fields, spooled = await read_upload_form(http_request.stream(), http_request.headers.get("content-type", ""))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except MalformedUpload as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    text = fields.get("text") or ""
+    execute = fields.get("execute_actions", "").lower() in ("1", "true", "yes")
+    image = None
+    if spooled is not None:
+        try:
+            image = await prepared_image(spooled)
+        finally:
+            spooled.close()
+
+    return await answer(text, http_request, current_user, image, execute)
+
+def encrypt_password(password: str):
+    return fernet.encrypt(password.encode()).decode()
+
+def decrypt_password(stored: str):
+    try:
+        return fernet.decrypt(stored.encode()).decode()
+    except Exception:
+        # Passwords saved before encryption was added are plaintext
+        return stored
+
+def sse_event(event: str, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_chat_events(request: AIChatRequest, current_user: dict, image: tuple = None):
+    user_id = str(current_user["_id"])
+    result = await route_locally(request.text, user_id, image)
+    version = cache_key = None
+    if result is None:
+        version = await schedule_version.current(user_id)
+        cache_key, result = cached_reply(request.text, user_id, version, image is not None)
+
+    if result is None:
+        schedule_context, credentials_context = await load_context(user_id, request.text, version)
+        intent_router.record_llm_fallback()
+        events = stream_user_input(request.text, schedule_context=schedule_context, cache_key=cache_key,
+                                   credentials_context=credentials_context, image=image)
+        # A client disconnect cancels this generator, which closes the model stream below
+        try:
+            async for event, data in events:
+                if event == "reply":
+                    yield sse_event("reply", {"delta": data})
+                elif event == "action":
+                    yield sse_event("action", data)
+                else:
+                    result = data
+        finally:
+            await events.aclose()
+    else:
+        # Local or cached answer: sent in one piece
+        yield sse_event("reply", {"delta": result.get("reply", "")})
+        for action in result.get("actions", []):
+            yield sse_event("action", action)
+
+    # Dispatch side effects run once the whole answer is known; `done` carries the
+    # final result, including the WhatsApp links added by the dispatch handling.
+    yield sse_event("done", await handle_actions(result, current_user, request.execute_actions))
+
+@router.post("/chat/stream")
+async def chat_stream(request: AIChatRequest, http_request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Server-Sent Events variant of /chat: `reply` events carry text deltas as the model
+    writes them, `action` events each action as soon as it is complete, and a final
+    `done` event the full response.
+    """
+    image = await prepared_image(request.image) if request.image else None
+    return StreamingResponse(
+        stream_chat_events(request, current_user, image),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def handle_actions(result: dict, current_user: dict, execute: bool = False):
+    """
+    Server-side effects of the returned actions (email / WhatsApp dispatch). With `execute`
+    the task and credential actions are applied too and reported in `action_results`,
+    so the client does not replay them.
+    """
+    if execute and result.get("actions"):
+        result["action_results"] = await execute_actions(result["actions"], str(current_user["_id"]), encrypt_password)
     # Process dispatch_schedule if present in actions
     if "actions" in result:
         for action in result["actions"]:
             if action.get("type") == "dispatch_schedule":
                 summary = action.get("summary", "Your today's schedule is ready.")
                 
-                # 1. Send Email
-                print(f"DEBUG: Attempting to send schedule email to {current_user['email']}")
-                email_success = send_email(current_user["email"], "Today's Schedule Summary - Dhana Durga", summary)
-                print(f"DEBUG: Email success status: {email_success}")
+                # 1. Queue Email (delivered and retried by the outbox workers)
+                await enqueue_email(current_user["email"], "Today's Schedule Summary - Dhana Durga", summary)
+                print(f"DEBUG: Queued schedule email to {current_user['email']}")
                 
-                # 2. Send Automated WhatsApp (Background)
-                print(f"DEBUG: Attempting to send automated WhatsApp message")
+                # 2. Queue Automated WhatsApp
                 whatsapp_number = "whatsapp:+917013666788" # Direct target as requested
-                wa_success = send_whatsapp_message(whatsapp_number, summary)
-                print(f"DEBUG: WhatsApp success status: {wa_success}")
+                await enqueue_whatsapp(whatsapp_number, summary)
+                print(f"DEBUG: Queued automated WhatsApp message")
                 
                 # 3. Add a direct WhatsApp link for the frontend to open
                 encoded_msg = urllib.parse.quote(summary)
@@ -75,16 +241,14 @@ async def chat(request: AIChatRequest, current_user: dict = Depends(get_current_
             elif action.get("type") == "dispatch_credentials":
                 summary = action.get("summary", "Here are the requested credentials.")
                 
-                # 1. Send Email
-                print(f"DEBUG: Attempting to send credentials email to {current_user['email']}")
-                email_success = send_email(current_user["email"], "Your Requested Credentials - Dhana Durga", summary)
-                print(f"DEBUG: Credentials Email success status: {email_success}")
+                # 1. Queue Email
+                await enqueue_email(current_user["email"], "Your Requested Credentials - Dhana Durga", summary, sensitive=True)
+                print(f"DEBUG: Queued credentials email to {current_user['email']}")
                 
-                # 2. Send Automated WhatsApp (Background)
-                print(f"DEBUG: Attempting to send automated credentials WhatsApp message")
+                # 2. Queue Automated WhatsApp
                 whatsapp_number = "whatsapp:+917013666788" 
-                wa_success = send_whatsapp_message(whatsapp_number, summary)
-                print(f"DEBUG: Credentials WhatsApp success status: {wa_success}")
+                await enqueue_whatsapp(whatsapp_number, summary, sensitive=True)
+                print(f"DEBUG: Queued automated credentials WhatsApp message")
                 
                 # 3. Add a direct WhatsApp link for the frontend
                 encoded_msg = urllib.parse.quote(summary)
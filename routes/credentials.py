@@ -1,34 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException
 from bson import ObjectId
 from typing import List
-import os
 from database import credentials_collection
 from models import CredentialCreate, CredentialResponse
-from routes.users import get_current_user
-from cryptography.fernet import Fernet
-
-encryption_key = os.getenv("ENCRYPTION_KEY", Fernet.generate_key().decode()).strip()
-fernet = Fernet(encryption_key.encode())
+from routes.users import get_current_user_id
+from services import schedule_version, ai_context
+from services.vault import fernet
 
 
 router = APIRouter(prefix="/credentials", tags=["credentials"])
 
 @router.post("/", response_model=CredentialResponse)
-async def create_credential(cred: CredentialCreate, current_user: dict = Depends(get_current_user)):
+async def create_credential(cred: CredentialCreate, user_id: str = Depends(get_current_user_id)):
     cred_dict = cred.dict()
-    cred_dict["user_id"] = str(current_user["_id"])
+    cred_dict["user_id"] = user_id
     
     # Encrypt password before saving
     if "password" in cred_dict and cred_dict["password"]:
         cred_dict["password"] = fernet.encrypt(cred_dict["password"].encode()).decode()
         
     result = await credentials_collection.insert_one(cred_dict)
+    ai_context.note_write(user_id, await schedule_version.bump(user_id), credentials=True)
     cred_dict["id"] = str(result.inserted_id)
     return cred_dict
 
 @router.get("/", response_model=List[CredentialResponse])
-async def get_credentials(current_user: dict = Depends(get_current_user)):
-    query = {"user_id": str(current_user["_id"])}
+async def get_credentials(user_id: str = Depends(get_current_user_id)):
+    query = {"user_id": user_id}
     cursor = credentials_collection.find(query)
     creds = []
     async for cred in cursor:
@@ -46,7 +44,7 @@ async def get_credentials(current_user: dict = Depends(get_current_user)):
     return creds
 
 @router.put("/{cred_id}", response_model=CredentialResponse)
-async def update_credential(cred_id: str, cred: CredentialCreate, current_user: dict = Depends(get_current_user)):
+async def update_credential(cred_id: str, cred: CredentialCreate, user_id: str = Depends(get_current_user_id)):
     update_data = {k: v for k, v in cred.dict().items() if v is not None}
     
     # Encrypt password if it is being updated
@@ -54,19 +52,21 @@ async def update_credential(cred_id: str, cred: CredentialCreate, current_user:
         update_data["password"] = fernet.encrypt(update_data["password"].encode()).decode()
 
     result = await credentials_collection.update_one(
-        {"_id": ObjectId(cred_id), "user_id": str(current_user["_id"])},
+        {"_id": ObjectId(cred_id), "user_id": user_id},
         {"$set": update_data}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Credential not found")
+    ai_context.note_write(user_id, await schedule_version.bump(user_id), credentials=True)
         
     updated = await credentials_collection.find_one({"_id": ObjectId(cred_id)})
     updated["id"] = str(updated["_id"])
     return updated
 
 @router.delete("/{cred_id}")
-async def delete_credential(cred_id: str, current_user: dict = Depends(get_current_user)):
-    result = await credentials_collection.delete_one({"_id": ObjectId(cred_id), "user_id": str(current_user["_id"])})
+async def delete_credential(cred_id: str, user_id: str = Depends(get_current_user_id)):
+    result = await credentials_collection.delete_one({"_id": ObjectId(cred_id), "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Credential not found")
+    ai_context.note_write(user_id, await schedule_version.bump(user_id), credentials=True)
     return {"message": "Credential deleted"}
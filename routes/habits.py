@@ -3,22 +3,22 @@ from bson import ObjectId
 from typing import List
 from database import db
 from models import HabitCreate, HabitResponse
-from routes.users import get_current_user
+from routes.users import get_current_user_id
 
 router = APIRouter(prefix="/habits", tags=["habits"])
 habits_collection = db.habits
 
 @router.post("/", response_model=HabitResponse)
-async def create_habit(habit: HabitCreate, current_user: dict = Depends(get_current_user)):
+async def create_habit(habit: HabitCreate, user_id: str = Depends(get_current_user_id)):
     habit_dict = habit.dict()
-    habit_dict["user_id"] = str(current_user["_id"])
+    habit_dict["user_id"] = user_id
     result = await habits_collection.insert_one(habit_dict)
     habit_dict["id"] = str(result.inserted_id)
     return habit_dict
 
 @router.get("/", response_model=List[HabitResponse])
-async def get_habits(current_user: dict = Depends(get_current_user)):
-    cursor = habits_collection.find({"user_id": str(current_user["_id"])})
+async def get_habits(user_id: str = Depends(get_current_user_id)):
+    cursor = habits_collection.find({"user_id": user_id})
     habits = []
     async for habit in cursor:
         habit["id"] = str(habit["_id"])
@@ -26,8 +26,8 @@ async def get_habits(current_user: dict = Depends(get_current_user)):
     return habits
 
 @router.put("/{habit_id}/toggle/{date}")
-async def toggle_habit(habit_id: str, date: str, current_user: dict = Depends(get_current_user)):
-    habit = await habits_collection.find_one({"_id": ObjectId(habit_id), "user_id": str(current_user["_id"])})
+async def toggle_habit(habit_id: str, date: str, user_id: str = Depends(get_current_user_id)):
+    habit = await habits_collection.find_one({"_id": ObjectId(habit_id), "user_id": user_id})
     if not habit:
         raise HTTPException(status_code=404, detail="Habit not found")
     
@@ -41,8 +41,8 @@ async def toggle_habit(habit_id: str, date: str, current_user: dict = Depends(ge
     return {"status": status[date]}
 
 @router.delete("/{habit_id}")
-async def delete_habit(habit_id: str, current_user: dict = Depends(get_current_user)):
-    result = await habits_collection.delete_one({"_id": ObjectId(habit_id), "user_id": str(current_user["_id"])})
+async def delete_habit(habit_id: str, user_id: str = Depends(get_current_user_id)):
+    result = await habits_collection.delete_one({"_id": ObjectId(habit_id), "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Habit not found")
     return {"message": "Habit deleted"}
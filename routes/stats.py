@@ -1,90 +1,149 @@
-from fastapi import APIRouter, Depends
-from database import tasks_collection, work_collection, meeting_collection, routine_collection, personal_collection, plans_collection
-from routes.users import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Query
+from routes.users import get_current_user_id
+from services.activity_store import facet_by_category
+from services.streaks import parse_dates, current_streak, longest_streak, consistency, completed_dates
+from services import rollups, stats_cache
 from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/stats", tags=["stats"])
 
-@router.get("/")
-async def get_stats(category: str = None, current_user: dict = Depends(get_current_user)):
-    user_id = str(current_user["_id"])
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    
-    # Collection mapping
+SERIES_BUCKETS = ("day", "week", "month")
+MAX_SERIES_DAYS = 366 * 5
+
+# Categories counted when no (known) category filter is given
+DEFAULT_STATS_KEYS = ["tasks", "work", "meetings", "routines", "personal"]
+
+def stats_keys_for(category: str = None):
+    """Category keys covered by a stats request for `category`."""
     mapping = {
-        "work": [work_collection],
-        "meeting": [meeting_collection],
-        "routine": [routine_collection],
-        "task": [tasks_collection],
-        "personal": [personal_collection],
-        "personal space": [personal_collection],
-        "plan": [plans_collection]
+        "work": ["work"],
+        "meeting": ["meetings"],
+        "routine": ["routines"],
+        "task": ["tasks"],
+        "personal": ["personal"],
+        "personal space": ["personal"],
+        "plan": ["plans"]
     }
-    
-    # Determine which collections to query
     if category and category.lower() in mapping:
-        active_collections = mapping[category.lower()]
-    elif category and category.lower() in ["personal", "personal space", "task"]:
-        # If frontend sends 'task', it might mean 'personal space'
-        active_collections = [personal_collection, tasks_collection]
-    else:
-        active_collections = [tasks_collection, work_collection, meeting_collection, routine_collection, personal_collection]
-    
-    total_tasks = 0
-    completed_tasks = 0
-    today_total = 0
-    today_completed = 0
-    
-    for coll in active_collections:
-        total_tasks += await coll.count_documents({"user_id": user_id})
-        completed_tasks += await coll.count_documents({"user_id": user_id, "status": "Completed"})
-        today_total += await coll.count_documents({"user_id": user_id, "date": today_str})
-        today_completed += await coll.count_documents({"user_id": user_id, "date": today_str, "status": "Completed"})
-    
-    completion_percentage = (today_completed / today_total * 100) if today_total > 0 else 0
-    
-    # Routine-specific stats (stays in routine_collection)
-    routine_total_week = await routine_collection.count_documents({
-        "user_id": user_id, 
-        "date": {"$gte": (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")}
+        return mapping[category.lower()]
+    return DEFAULT_STATS_KEYS
+
+def count_stage(match: dict = None):
+    """$facet branch that counts the documents matching `match`."""
+    return ([{"$match": match}] if match else []) + [{"$count": "n"}]
+
+def facet_count(docs):
+    return docs[0]["n"] if docs else 0
+
+async def stats_counts_from_facets(user_id: str, active_keys, today_str: str, week_start: str, first_of_month: str):
+    """get_stats counters from one $facet pipeline per collection (every metric is a branch)."""
+    branches = {}
+    for key in active_keys:
+        branches[key] = {
+            "total": count_stage(),
+            "completed": count_stage({"status": "Completed"}),
+            "today_total": count_stage({"date": today_str}),
+            "today_completed": count_stage({"date": today_str, "status": "Completed"}),
+        }
+    branches.setdefault("routines", {}).update({
+        "week_total": count_stage({"date": {"$gte": week_start}}),
+        "week_completed": count_stage({"status": "Completed", "date": {"$gte": week_start}}),
+        "month_total": count_stage({"date": {"$gte": first_of_month}}),
+        "month_completed": count_stage({"status": "Completed", "date": {"$gte": first_of_month}}),
+        "completed_dates": [
+            {"$match": {"status": "Completed"}},
+            {"$group": {"_id": "$date"}}
+        ],
     })
-    routine_completed_week = await routine_collection.count_documents({
-        "user_id": user_id, 
-        "status": "Completed",
-        "date": {"$gte": (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")}
+    branches.setdefault("plans", {}).update({
+        "plans_total": count_stage(),
+        "plans_completed": count_stage({"status": "Completed"}),
+        "plans_upcoming": count_stage({"date": {"$gte": today_str}, "status": {"$ne": "Completed"}}),
     })
+
+    results = await facet_by_category({"user_id": user_id}, branches)
+
+    counts = {}
+    for name in ("total", "completed", "today_total", "today_completed"):
+        counts[name] = sum(facet_count(results[key][name]) for key in active_keys)
+    for name in ("week_total", "week_completed", "month_total", "month_completed"):
+        counts[name] = facet_count(results["routines"][name])
+    for name in ("plans_total", "plans_completed", "plans_upcoming"):
+        counts[name] = facet_count(results["plans"][name])
+    routine_dates = {doc["_id"] for doc in results["routines"]["completed_dates"]}
+    return counts, routine_dates
+
+async def stats_counts_from_rollups(user_id: str, active_keys, today_str: str, week_start: str, first_of_month: str):
+    """Same counters as stats_counts_from_facets, summed from the daily rollup rows."""
+    counts = dict.fromkeys((
+        "total", "completed", "today_total", "today_completed",
+        "week_total", "week_completed", "month_total", "month_completed",
+        "plans_total", "plans_completed", "plans_upcoming"
+    ), 0)
+    routine_dates = set()
+
+    for row in await rollups.fetch_rows(user_id, set(active_keys) | {"routines", "plans"}):
+        key, date = row["category"], row.get("date") or ""
+        total, completed = row.get("total", 0), row.get("completed", 0)
+        if key in active_keys:
+            counts["total"] += total
+            counts["completed"] += completed
+            if date == today_str:
+                counts["today_total"] += total
+                counts["today_completed"] += completed
+        if key == "routines":
+            if date >= week_start:
+                counts["week_total"] += total
+                counts["week_completed"] += completed
+            if date >= first_of_month:
+                counts["month_total"] += total
+                counts["month_completed"] += completed
+            if completed > 0:
+                routine_dates.add(date)
+        if key == "plans":
+            counts["plans_total"] += total
+            counts["plans_completed"] += completed
+            if date >= today_str:
+                counts["plans_upcoming"] += total - completed
+    return counts, routine_dates
+
+@router.get("/")
+async def get_stats(category: str = None, user_id: str = Depends(get_current_user_id)):
+    now = datetime.now()
+    today_str = now.strftime("%Y-%m-%d")
+    week_start = (now - timedelta(days=7)).strftime("%Y-%m-%d")
+    first_of_month = now.replace(day=1).strftime("%Y-%m-%d")
+
+    active_keys = stats_keys_for(category)
+    load_counts = stats_counts_from_rollups if rollups.STATS_FROM_ROLLUPS else stats_counts_from_facets
+    counts, routine_dates = await stats_cache.cached(
+        user_id, "stats", (category or "").lower(),
+        lambda: load_counts(user_id, active_keys, today_str, week_start, first_of_month)
+    )
+
+    total_tasks = counts["total"]
+    completed_tasks = counts["completed"]
+    today_total = counts["today_total"]
+    today_completed = counts["today_completed"]
+
+    completion_percentage = (today_completed / today_total * 100) if today_total > 0 else 0
+
+    # Routine-specific stats (routines only)
+    routine_total_week = counts["week_total"]
+    routine_completed_week = counts["week_completed"]
     weekly_consistency = (routine_completed_week / routine_total_week * 100) if routine_total_week > 0 else 0
 
-    # Calculate Streak
-    streak = 0
-    for i in range(30):
-        check_date = (datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
-        day_completed = await routine_collection.count_documents({
-            "user_id": user_id,
-            "status": "Completed",
-            "date": check_date
-        })
-        if day_completed > 0:
-            streak += 1
-        else:
-            if i > 0: break
-    
+    # Calculate Streak (uncapped, from the distinct completed dates)
+    streak = current_streak(parse_dates(routine_dates), now.date())
+
     # Monthly Target
-    first_of_month = datetime.now().replace(day=1).strftime("%Y-%m-%d")
-    monthly_completed = await routine_collection.count_documents({
-        "user_id": user_id,
-        "status": "Completed",
-        "date": {"$gte": first_of_month}
-    })
-    monthly_total = await routine_collection.count_documents({
-        "user_id": user_id,
-        "date": {"$gte": first_of_month}
-    })
+    monthly_completed = counts["month_completed"]
+    monthly_total = counts["month_total"]
 
     # Plan/Trip specific stats
-    plans_total = await plans_collection.count_documents({"user_id": user_id})
-    plans_completed = await plans_collection.count_documents({"user_id": user_id, "status": "Completed"})
-    plans_upcoming = await plans_collection.count_documents({"user_id": user_id, "date": {"$gte": today_str}, "status": {"$ne": "Completed"}})
+    plans_total = counts["plans_total"]
+    plans_completed = counts["plans_completed"]
+    plans_upcoming = counts["plans_upcoming"]
 
     return {
         "total_tasks": total_tasks,
@@ -108,27 +167,92 @@ async def get_stats(category: str = None, current_user: dict = Depends(get_curre
         "status": "Success"
     }
 
+@router.get("/streaks")
+async def get_streaks(category: str = None, window: int = Query(30, ge=1, le=MAX_SERIES_DAYS),
+                      user_id: str = Depends(get_current_user_id)):
+    """Current / longest streak and consistency over the last `window` days."""
+    today = datetime.now().date()
+
+    keys = tuple(stats_keys_for(category))
+    dates = await stats_cache.cached(user_id, "completed_dates", keys, lambda: completed_dates(user_id, keys))
+    window_start = today - timedelta(days=window - 1)
+
+    return {
+        "category": category,
+        "current_streak": current_streak(dates, today),
+        "longest_streak": longest_streak(dates),
+        "consistency": {
+            "window_days": window,
+            "active_days": sum(1 for day in dates if window_start <= day <= today),
+            "percentage": round(consistency(dates, window_start, today), 2)
+        },
+        "last_completed": max(dates).strftime("%Y-%m-%d") if dates else None,
+        "status": "Success"
+    }
+
+def bucket_label(day: datetime, bucket: str):
+    if bucket == "week":
+        # Buckets are labelled by their Monday
+        return (day - timedelta(days=day.weekday())).strftime("%Y-%m-%d")
+    if bucket == "month":
+        return day.strftime("%Y-%m")
+    return day.strftime("%Y-%m-%d")
+
+async def build_series(user_id: str, start: datetime, end: datetime, bucket: str = "day", category: str = None):
+    """Zero-filled [{"date", "total", "completed"}] buckets between start and end, oldest first."""
+    params = (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), bucket, tuple(stats_keys_for(category)))
+    return await stats_cache.cached(user_id, "series", params, lambda: _build_series(user_id, start, end, bucket, category))
+
+async def _build_series(user_id: str, start: datetime, end: datetime, bucket: str, category: str):
+    counts = await rollups.daily_counts(user_id, stats_keys_for(category), start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+
+    series = {}
+    day = start
+    while day <= end:
+        entry = series.setdefault(bucket_label(day, bucket), {"total": 0, "completed": 0})
+        day_counts = counts.get(day.strftime("%Y-%m-%d"))
+        if day_counts:
+            entry["total"] += day_counts["total"]
+            entry["completed"] += day_counts["completed"]
+        day += timedelta(days=1)
+
+    return [{"date": label, **values} for label, values in series.items()]
+
+@router.get("/series")
+async def get_series(
+    from_date: str = Query(None, alias="from"), # YYYY-MM-DD, defaults to 6 days before `to`
+    to_date: str = Query(None, alias="to"), # YYYY-MM-DD, defaults to today
+    bucket: str = "day", # day, week, month
+    category: str = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    if bucket not in SERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(SERIES_BUCKETS)}")
+    try:
+        end = datetime.strptime(to_date, "%Y-%m-%d") if to_date else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = datetime.strptime(from_date, "%Y-%m-%d") if from_date else end - timedelta(days=6)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from/to must be YYYY-MM-DD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if (end - start).days > MAX_SERIES_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {MAX_SERIES_DAYS} days")
+
+    series = await build_series(user_id, start, end, bucket, category)
+    return {
+        "from": start.strftime("%Y-%m-%d"),
+        "to": end.strftime("%Y-%m-%d"),
+        "bucket": bucket,
+        "category": category,
+        "series": series,
+        "total": sum(item["total"] for item in series),
+        "completed": sum(item["completed"] for item in series),
+        "status": "Success"
+    }
+
 @router.get("/weekly")
-async def get_weekly_stats(current_user: dict = Depends(get_current_user)):
-    user_id = str(current_user["_id"])
-    today = datetime.now()
-    
-    collections = [tasks_collection, work_collection, meeting_collection, routine_collection, personal_collection]
-    weekly_data = []
-    
-    for i in range(7):
-        date = (today - timedelta(days=i)).strftime("%Y-%m-%d")
-        total = 0
-        completed = 0
-        
-        for coll in collections:
-            total += await coll.count_documents({"user_id": user_id, "date": date})
-            completed += await coll.count_documents({"user_id": user_id, "date": date, "status": "Completed"})
-            
-        weekly_data.append({
-            "date": date,
-            "total": total,
-            "completed": completed
-        })
-        
-    return weekly_data
+async def get_weekly_stats(user_id: str = Depends(get_current_user_id)):
+    # Last 7 days, newest first
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    series = await build_series(user_id, today - timedelta(days=6), today)
+    return series[::-1]
@@ -1,24 +1,100 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
 from database import users_collection
 from models import UserCreate, UserInDB, Token, ForgotPasswordRequest, ResetPasswordRequest, UpdatePasswordRequest
-from auth.utils import get_password_hash, verify_password, create_access_token, decode_access_token
-from services.email_service import send_email
+from auth.utils import (
+    get_password_hash_async, verify_password_async, needs_rehash,
+    create_access_token, decode_access_token
+)
+from services.outbox import enqueue_email
+from services.cache import TTLCache
+import os
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# User documents by token subject (email), so protected routes skip the lookup
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# Current token_version per user_id. Bumping it (password change/reset) revokes
+# every token issued before; the TTL bounds how long other workers accept them.
+TOKEN_VERSION_TTL = float(os.getenv("TOKEN_VERSION_TTL", "60"))
+_token_versions = TTLCache(maxsize=USER_CACHE_SIZE, ttl=TOKEN_VERSION_TTL)
+
+def invalidate_cached_user(email: str):
+    _user_cache.pop(email)
+
+def user_cache_stats():
+    return _user_cache.stats()
+
+def issue_access_token(user: dict):
+    """Access token whose claims are enough to authenticate without a user lookup."""
+    return create_access_token(data={
+        "sub": user["email"],
+        "uid": str(user["_id"]),
+        "ver": user.get("token_version", 0)
+    })
+
+async def current_token_version(user_id: str):
+    version = _token_versions.get(user_id)
+    if version is None:
+        user = await users_collection.find_one({"_id": ObjectId(user_id)}, {"token_version": 1})
+        if not user:
+            return None
+        version = user.get("token_version", 0)
+        _token_versions.set(user_id, version)
+    return version
+
+async def set_password(user_filter: dict, hashed_password: str):
+    """Store a new password hash and revoke every token issued so far. Returns the updated user."""
+    user = await users_collection.find_one_and_update(
+        user_filter,
+        {"$set": {"password": hashed_password}, "$inc": {"token_version": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if user:
+        invalidate_cached_user(user["email"])
+        _token_versions.set(str(user["_id"]), user["token_version"])
+    return user
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     payload = decode_access_token(token)
     if not payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     email = payload.get("sub")
-    user = await users_collection.find_one({"email": email})
+    user = _user_cache.get(email)
     if not user:
+        user = await users_collection.find_one({"email": email})
+        if not user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        _user_cache.set(email, user)
+    # The cached document may predate a revocation; the version lookup has the shorter TTL
+    if payload.get("ver", 0) != await current_token_version(str(user["_id"])):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+    # Handlers may annotate the document (e.g. "id"), keep the cached one clean
+    return dict(user)
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme)):
+    """Authenticated user id from verified token claims only - for routes that don't need the user document."""
+    payload = decode_access_token(token)
+    if not payload:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    user_id = payload.get("uid")
+    if not user_id:
+        # Token issued before the id was part of the claims
+        user = await get_current_user(token)
+        return str(user["_id"])
+    version = await current_token_version(user_id)
+    if version is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    if payload.get("ver", 0) != version:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+    return user_id
 
 @router.post("/register", response_model=UserInDB)
 async def register(user: UserCreate):
@@ -27,7 +103,7 @@ async def register(user: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     user_dict = user.dict()
-    user_dict["password"] = get_password_hash(user.password)
+    user_dict["password"] = await get_password_hash_async(user.password)
     user_dict["created_at"] = datetime.utcnow()
     
     result = await users_collection.insert_one(user_dict)
@@ -37,10 +113,18 @@ async def register(user: UserCreate):
 @router.post("/login", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await users_collection.find_one({"email": form_data.username})
-    if not user or not verify_password(form_data.password, user["password"]):
+    if not user or not await verify_password_async(form_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
+
+    # Transparently upgrade hashes made with an older work factor
+    if needs_rehash(user["password"]):
+        await users_collection.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"password": await get_password_hash_async(form_data.password)}}
+        )
+        invalidate_cached_user(user["email"])
     
-    access_token = create_access_token(data={"sub": user["email"]})
+    access_token = issue_access_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserInDB)
@@ -56,7 +140,11 @@ async def forgot_password(req: ForgotPasswordRequest, request: Request):
         return {"message": "If an account exists with this email, a reset link has been sent."}
     
     # Create a short-lived token (15 mins)
-    reset_token = create_access_token(data={"sub": user["email"], "purpose": "reset"}, expires_delta=timedelta(minutes=15))
+    # "ver" makes the link single-use: resetting bumps the user's token_version
+    reset_token = create_access_token(
+        data={"sub": user["email"], "purpose": "reset", "ver": user.get("token_version", 0)},
+        expires_delta=timedelta(minutes=15)
+    )
     
     # Send email
     # Dynamically determine the origin URL (localhost vs production)
@@ -73,9 +161,8 @@ async def forgot_password(req: ForgotPasswordRequest, request: Request):
     If you didn't request this, please ignore this email.
     """
     
-    success = send_email(user["email"], "Reset Your Password - Dhana Durga", email_body)
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to send reset email")
+    # Delivered (and retried) by the outbox workers
+    await enqueue_email(user["email"], "Reset Your Password - Dhana Durga", email_body, sensitive=True)
         
     return {"message": "Reset link sent to your email."}
 
@@ -86,27 +173,30 @@ async def reset_password(req: ResetPasswordRequest):
         raise HTTPException(status_code=400, detail="Invalid or expired reset token")
     
     email = payload.get("sub")
-    hashed_password = get_password_hash(req.new_password)
+    hashed_password = await get_password_hash_async(req.new_password)
     
-    result = await users_collection.update_one(
-        {"email": email},
-        {"$set": {"password": hashed_password}}
-    )
+    # Only matches while the link's version is current (None covers users without the field)
+    version = payload.get("ver", 0)
+    version_filter = {"$in": [0, None]} if version == 0 else version
+    user = await set_password({"email": email, "token_version": version_filter}, hashed_password)
     
-    if result.modified_count == 0:
+    if not user:
         raise HTTPException(status_code=400, detail="Failed to reset password")
         
     return {"message": "Password reset successfully. You can now log in."}
 
 @router.post("/update-password")
 async def update_password(req: UpdatePasswordRequest, current_user: dict = Depends(get_current_user)):
-    if not verify_password(req.old_password, current_user["password"]):
+    # The cached user document may hold an outdated hash, check against the stored one
+    stored = await users_collection.find_one({"_id": current_user["_id"]}, {"password": 1})
+    if not stored or not await verify_password_async(req.old_password, stored["password"]):
         raise HTTPException(status_code=400, detail="Incorrect current password")
     
-    hashed_password = get_password_hash(req.new_password)
-    await users_collection.update_one(
-        {"_id": current_user["_id"]},
-        {"$set": {"password": hashed_password}}
-    )
+    hashed_password = await get_password_hash_async(req.new_password)
+    # Only replace the hash that was just verified
+    user = await set_password({"_id": current_user["_id"], "password": stored["password"]}, hashed_password)
+    if not user:
+        raise HTTPException(status_code=409, detail="Password was changed meanwhile, please try again")
     
-    return {"message": "Password updated successfully."}
+    # Older tokens are revoked now, hand this session a fresh one
+    return {"message": "Password updated successfully.", "access_token": issue_access_token(user), "token_type": "bearer"}
@@ -0,0 +1,207 @@
+"""
+Server-side execution of the actions returned by the assistant.
+
+Instead of the frontend replaying every `add_task` / `update_task` / `delete_task` /
+`manage_credential` as its own REST call, the whole batch is validated, resolved
+with one title lookup, grouped per collection and written with bulk operations.
+Every action gets a result entry at its own index.
+"""
+import re
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+from pydantic import ValidationError
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from models import TaskCreate, TaskUpdate, CredentialBase
+from database import credentials_collection
+from services import activity_store, schedule_version, ai_context
+
+def _result(index: int, action: dict, status: str, **extra):
+    return {"index": index, "type": action.get("type"), "status": status, **extra}
+
+
+def _pick_target(matches: list, today: str):
+    """Nearest upcoming item with the title, else the most recent one."""
+    upcoming = [m for m in matches if (m[0].get("date") or "") >= today]
+    return upcoming[0] if upcoming else matches[-1]
+
+
+async def _find_credentials(user_id: str, names: set):
+    """{lowercased service name: [credential docs]} for the user, in one query."""
+    if not names:
+        return {}
+    patterns = [re.compile(f"^{re.escape(name)}$", re.IGNORECASE) for name in names]
+    found = {}
+    async for cred in credentials_collection.find({"user_id": user_id, "service_name": {"$in": patterns}}):
+        found.setdefault(cred.get("service_name", "").lower(), []).append(cred)
+    return found
+
+
+async def execute_actions(actions: list, user_id: str, encrypt):
+    """
+    Apply the assistant's actions for `user_id`. `encrypt(plaintext) -> str` seals
+    credential passwords. Returns one result dict per action, in order.
+    """
+    results = [None] * len(actions)
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    # 1. Validate
+    inserts, updates, deletes, cred_actions = [], [], [], []
+    for i, action in enumerate(actions):
+        kind = action.get("type") if isinstance(action, dict) else None
+        if kind in ("add_task", "update_task", "delete_task", "manage_credential") and \
+                not isinstance(action.get("data") or {}, dict):
+            results[i] = _result(i, action, "invalid", detail="data must be an object")
+            continue
+        try:
+            if kind == "add_task":
+                task = TaskCreate(**(action.get("data") or {})).dict()
+                task.update(user_id=user_id, ai_generated=True)
+                inserts.append((i, task))
+            elif kind in ("update_task", "delete_task"):
+                title = action.get("target_title") or (action.get("data") or {}).get("title")
+                if not title:
+                    results[i] = _result(i, action, "invalid", detail="target_title is required")
+                    continue
+                if kind == "update_task":
+                    data = {k: v for k, v in TaskUpdate(**(action.get("data") or {})).dict().items() if v is not None}
+                    # The title in `data` may be the lookup key rather than a rename
+                    if not action.get("target_title"):
+                        data.pop("title", None)
+                    updates.append((i, title, data))
+                else:
+                    deletes.append((i, title))
+            elif kind == "manage_credential":
+                op = (action.get("action") or "add").lower()
+                data = action.get("data") or {}
+                if op == "add":
+                    data = CredentialBase(**data).dict()
+                elif op not in ("update", "delete") or not data.get("service_name"):
+                    results[i] = _result(i, action, "invalid", detail="unknown action or missing service_name")
+                    continue
+                cred_actions.append((i, op, data))
+            else:
+                # dispatch_* are handled by the chat endpoint, set_timer is client-side
+                results[i] = _result(i, action if isinstance(action, dict) else {}, "skipped")
+        except (ValidationError, TypeError) as e:
+            results[i] = _result(i, action, "invalid", detail=str(e))
+
+    # 2. Resolve targets with one lookup per store
+    titles = {title for _, title, _ in updates} | {title for _, title in deletes}
+    cred_names = {data["service_name"] for _, op, data in cred_actions if op != "add"}
+    task_matches, cred_matches = await asyncio.gather(
+        activity_store.find_by_titles(user_id, list(titles)) if titles else asyncio.sleep(0, result={}),
+        _find_credentials(user_id, cred_names)
+    )
+
+    # Deletes first: updates to a document deleted in the same batch are dropped
+    deleted = {}
+    for i, title in deletes:
+        matches = task_matches.get(title.lower())
+        if not matches:
+            results[i] = _result(i, actions[i], "not_found")
+            continue
+        target = _pick_target(matches, today)
+        deleted.setdefault(target[0]["_id"], target)
+        results[i] = _result(i, actions[i], "deleted", id=str(target[0]["_id"]))
+    task_deletes = list(deleted.values())
+
+    # All updates to one document fold into a single $set (later actions win), so
+    # the rollups see one before -> after transition per document
+    folded = {}
+    for i, title, data in updates:
+        matches = task_matches.get(title.lower())
+        if not matches:
+            results[i] = _result(i, actions[i], "not_found")
+            continue
+        doc, key = _pick_target(matches, today)
+        if doc["_id"] in deleted:
+            results[i] = _result(i, actions[i], "skipped", id=str(doc["_id"]), detail="deleted in the same batch")
+            continue
+        folded.setdefault(doc["_id"], (doc, key, {}))[2].update(data)
+        results[i] = _result(i, actions[i], "updated", id=str(doc["_id"]))
+    task_changes = list(folded.values())
+
+    # Same for credentials: resolve every target, then one operation per document
+    cred_targets = {}
+    for i, op, data in cred_actions:
+        if op == "add":
+            continue
+        candidates = cred_matches.get(data["service_name"].lower(), [])
+        if data.get("identifier_value"):
+            candidates = [c for c in candidates if c.get("identifier_value") == data["identifier_value"]] or candidates
+        if not candidates:
+            results[i] = _result(i, actions[i], "not_found")
+            continue
+        cred_targets[i] = candidates[0]
+    deleted_cred_ids = {cred_targets[i]["_id"] for i, op, _ in cred_actions if op == "delete" and i in cred_targets}
+    deleted_creds = set(deleted_cred_ids)   # ids still waiting for their DeleteOne
+
+    # Passwords are sealed as the operations are built, before anything is written
+    cred_ops, cred_indexes = [], []
+    cred_updates = {}   # credential _id -> ($set, [action indexes])
+    for i, op, data in cred_actions:
+        if op == "add":
+            doc = {**data, "_id": ObjectId(), "user_id": user_id}
+            if doc.get("password"):
+                doc["password"] = encrypt(doc["password"])
+            cred_ops.append(InsertOne(doc))
+            cred_indexes.append(i)
+            results[i] = _result(i, actions[i], "created", id=str(doc["_id"]))
+            continue
+        if i not in cred_targets:
+            continue
+        target = cred_targets[i]
+        if op == "delete":
+            if target["_id"] in deleted_creds:
+                deleted_creds.discard(target["_id"])
+                cred_ops.append(DeleteOne({"_id": target["_id"], "user_id": user_id}))
+            cred_indexes.append(i)
+            results[i] = _result(i, actions[i], "deleted", id=str(target["_id"]))
+        elif target["_id"] in deleted_cred_ids:
+            results[i] = _result(i, actions[i], "skipped", id=str(target["_id"]), detail="deleted in the same batch")
+        else:
+            changes = {k: v for k, v in data.items() if v is not None and k in CredentialBase.__fields__}
+            if changes.get("password"):
+                changes["password"] = encrypt(changes["password"])
+            merged, indexes = cred_updates.setdefault(target["_id"], ({}, []))
+            merged.update(changes)
+            indexes.append(i)
+            results[i] = _result(i, actions[i], "updated", id=str(target["_id"]))
+    for cred_id, (changes, indexes) in cred_updates.items():
+        cred_ops.append(UpdateOne({"_id": cred_id, "user_id": user_id}, {"$set": changes}))
+        cred_indexes.extend(indexes)
+
+    # 3. Apply: one bulk write per collection, all concurrently
+    async def write_credentials():
+        if cred_ops:
+            await credentials_collection.bulk_write(cred_ops, ordered=False)
+            ai_context.note_write(user_id, await schedule_version.bump(user_id), credentials=True)
+
+    outcomes = await asyncio.gather(
+        activity_store.insert_activities([task for _, task in inserts]),
+        activity_store.update_activities(task_changes),
+        activity_store.delete_activities(task_deletes),
+        write_credentials(),
+        return_exceptions=True
+    )
+    if not isinstance(outcomes[0], Exception):
+        for (i, _), task_id in zip(inserts, outcomes[0]):
+            results[i] = _result(i, actions[i], "created", id=str(task_id))
+
+    # A failed batch marks all of its actions, the others still went through
+    batches = (
+        [i for i, _ in inserts],
+        [i for i, _, _ in updates if results[i]["status"] == "updated"],
+        [i for i, _ in deletes if results[i]["status"] == "deleted"],
+        cred_indexes,
+    )
+    for outcome, indexes in zip(outcomes, batches):
+        if isinstance(outcome, Exception):
+            print(f"AI action batch failed for {user_id}: {outcome}")
+            for i in indexes:
+                results[i] = _result(i, actions[i], "error", detail=str(outcome))
+
+    print(f"DEBUG: Executed AI actions for {user_id}: {len(inserts)} inserts, {len(task_changes)} updates, "
+          f"{len(task_deletes)} deletes, {len(cred_ops)} credential writes")
+    return results
@@ -0,0 +1,105 @@
+"""
+Online migration from the per-category collections to the unified `activities` store.
+
+Cutover:
+1. Deploy with ACTIVITY_STORE=dual - every write now lands in both layouts.
+2. python -m services.activity_migration copy      (batched, resumable, safe to re-run)
+3. python -m services.activity_migration verify    (per-category counts must match)
+   python -m services.activity_migration reconcile (drops copies of docs deleted mid-copy)
+4. Deploy with ACTIVITY_STORE=unified.
+
+`copy` only inserts documents that are not in `activities` yet, so a newer version
+mirrored by a dual-write is never overwritten by the stale copy read from the batch.
+"""
+import argparse
+import asyncio
+from pymongo.errors import BulkWriteError
+from database import activities_collection
+from services.activity_store import SPLIT_COLLECTIONS
+
+DEFAULT_BATCH_SIZE = 500
+
+
+async def copy_category(key: str, batch_size: int = DEFAULT_BATCH_SIZE):
+    source = SPLIT_COLLECTIONS[key]
+    copied = 0
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        batch = await source.find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        for doc in batch:
+            doc["category_key"] = key
+        try:
+            result = await activities_collection.insert_many(batch, ordered=False)
+            copied += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate keys are documents already mirrored by dual-writes - keep those
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if errors:
+                raise
+            copied += e.details.get("nInserted", 0)
+        print(f"[{key}] copied {copied} (last _id {last_id})")
+    return copied
+
+
+async def copy_all(batch_size: int = DEFAULT_BATCH_SIZE):
+    for key in SPLIT_COLLECTIONS:
+        await copy_category(key, batch_size)
+
+
+async def verify():
+    """Compare per-category document counts between both layouts."""
+    ok = True
+    for key, source in SPLIT_COLLECTIONS.items():
+        split_count = await source.count_documents({})
+        unified_count = await activities_collection.count_documents({"category_key": key})
+        status = "OK" if split_count == unified_count else "MISMATCH"
+        ok = ok and split_count == unified_count
+        print(f"[{key}] split={split_count} unified={unified_count} {status}")
+    return ok
+
+
+async def reconcile(batch_size: int = DEFAULT_BATCH_SIZE):
+    """Remove unified copies whose source document no longer exists."""
+    removed = 0
+    for key, source in SPLIT_COLLECTIONS.items():
+        last_id = None
+        while True:
+            query = {"category_key": key}
+            if last_id:
+                query["_id"] = {"$gt": last_id}
+            ids = [doc["_id"] async for doc in activities_collection.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)]
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            present = {doc["_id"] async for doc in source.find({"_id": {"$in": ids}}, {"_id": 1})}
+            orphans = [_id for _id in ids if _id not in present]
+            if orphans:
+                result = await activities_collection.delete_many({"_id": {"$in": orphans}, "category_key": key})
+                removed += result.deleted_count
+        print(f"[{key}] reconciled, removed {removed} so far")
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate activities to the unified store")
+    parser.add_argument("command", choices=["copy", "verify", "reconcile"])
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "copy":
+        asyncio.run(copy_all(args.batch_size))
+    elif args.command == "verify":
+        if not asyncio.run(verify()):
+            raise SystemExit(1)
+    else:
+        asyncio.run(reconcile(args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
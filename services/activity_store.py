@@ -0,0 +1,408 @@
+"""
+Data-access layer for schedule items (tasks, work, meetings, routines, personal, plans).
+
+Two physical layouts are supported and selected with ACTIVITY_STORE:
+- "split"   : one collection per category (legacy layout)
+- "dual"    : split collections stay the source of truth, every write is mirrored
+              into the unified `activities` collection (used during the migration)
+- "unified" : everything lives in `activities`, keyed by `category_key`
+
+Callers never pick a collection themselves - they ask for `activity_sources()` or use
+the read/write helpers below, so switching layout is a config change.
+"""
+import os
+import re
+import asyncio
+import heapq
+from bson import ObjectId
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from database import (
+    tasks_collection, work_collection,
+    meeting_collection, routine_collection,
+    personal_collection, plans_collection,
+    activities_collection
+)
+from services import task_locator, rollups, stats_cache, schedule_version, ai_context, reminders
+
+ACTIVITY_STORE = os.getenv("ACTIVITY_STORE", "split").strip().lower()
+
+# category_key -> legacy collection. The key doubles as the legacy collection name.
+SPLIT_COLLECTIONS = {
+    "tasks": tasks_collection,
+    "work": work_collection,
+    "meetings": meeting_collection,
+    "routines": routine_collection,
+    "personal": personal_collection,
+    "plans": plans_collection,
+}
+ACTIVITY_KEYS = list(SPLIT_COLLECTIONS)
+
+# Case-insensitive category label -> category_key
+CATEGORY_KEYS = {
+    "work": "work",
+    "meeting": "meetings",
+    "routine": "routines",
+    "task": "tasks",
+    "personal": "personal",
+    "personal space": "personal",
+    "plan": "plans",
+}
+
+# Stable display order for activities: date, then start time (missing values first)
+SORT_SPEC = [("date", 1), ("start_time", 1), ("_id", 1)]
+
+
+def is_unified():
+    return ACTIVITY_STORE == "unified"
+
+
+def is_dual_write():
+    return ACTIVITY_STORE == "dual"
+
+
+def category_key(category: str):
+    """Normalize a category label ('Meeting', 'Personal Space', ...) to its storage key."""
+    if not category:
+        return "tasks"
+    return CATEGORY_KEYS.get(category.lower(), "tasks")
+
+
+def get_collection_for_category(category: str):
+    """Collection that holds `category` items under the active layout."""
+    if is_unified():
+        return activities_collection
+    return SPLIT_COLLECTIONS[category_key(category)]
+
+
+def activity_sources(keys=None):
+    """
+    (collection, filter) pairs that together cover the given category keys.
+    Merge the filter into every query sent to the collection.
+    """
+    keys = list(keys) if keys else ACTIVITY_KEYS
+    if is_unified():
+        return [(activities_collection, {"category_key": {"$in": keys}})]
+    return [(SPLIT_COLLECTIONS[key], {}) for key in keys]
+
+
+def activity_sort_key(task: dict):
+    return (task.get("date") or "", task.get("start_time") or "", str(task.get("_id", "")))
+
+
+async def _fetch_sorted(coll, query: dict, projection=None):
+    """Drain one source, already ordered by SORT_SPEC on the server."""
+    tasks = []
+    async for task in coll.find(query, projection).sort(SORT_SPEC):
+        task["id"] = str(task["_id"])
+        tasks.append(task)
+    return tasks
+
+
+async def find_activities(query: dict, keys=None, projection=None):
+    """All matching activities across `keys`, sources queried concurrently and merged in order."""
+    sources = activity_sources(keys)
+    results = await asyncio.gather(*(_fetch_sorted(coll, {**query, **f}, projection) for coll, f in sources))
+    if len(results) == 1:
+        return results[0]
+    return list(heapq.merge(*results, key=activity_sort_key))
+
+
+async def iter_activity_batches(query: dict, keys=None):
+    """Yield each source's sorted batch as soon as it arrives (for streaming responses)."""
+    pending = [asyncio.ensure_future(_fetch_sorted(coll, {**query, **f})) for coll, f in activity_sources(keys)]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            yield await next_done
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+async def _mirror(doc: dict, key: str):
+    """Dual-write: upsert the latest version of a split document into `activities`."""
+    mirrored = {k: v for k, v in doc.items() if k != "id"}
+    mirrored["category_key"] = key
+    await activities_collection.replace_one({"_id": doc["_id"]}, mirrored, upsert=True)
+
+
+async def _after_write(before: dict = None, before_key: str = None, after: dict = None, after_key: str = None):
+    """Keep derived data (rollups, caches, schedule version, reminder queue) in step with a create / update / delete."""
+    await _after_writes([(before, before_key, after, after_key)])
+
+
+async def _after_writes(changes: list):
+    """Batch form of `_after_write`: one rollup bulk write and one version bump per user."""
+    touched = {}
+    for before, _, after, _ in changes:
+        user_id = (after or before).get("user_id")
+        touched.setdefault(user_id, set()).update(doc.get("date") for doc in (before, after) if doc)
+    for user_id in touched:
+        stats_cache.invalidate_user(user_id)
+    reminders.note_changes(changes)
+    _, *versions = await asyncio.gather(
+        rollups.apply_changes(changes),
+        *(schedule_version.bump(user_id) for user_id in touched)
+    )
+    # Only the days these writes touched need re-rendering in the AI prompt context
+    for (user_id, days), version in zip(touched.items(), versions):
+        ai_context.note_write(user_id, version, days)
+
+
+async def insert_activity(doc: dict):
+    """Insert a new activity. Returns the inserted ObjectId."""
+    key = category_key(doc.get("category"))
+    if is_unified():
+        doc["category_key"] = key
+        result = await activities_collection.insert_one(doc)
+        await _after_write(after=doc, after_key=key)
+        return result.inserted_id
+
+    doc["_id"] = ObjectId()
+    await SPLIT_COLLECTIONS[key].insert_one(doc)
+    # Only once the document exists, so a failed insert never leaves a locator entry behind
+    await task_locator.remember(doc["_id"], key, doc.get("user_id"))
+    if is_dual_write():
+        try:
+            await activities_collection.insert_one({**doc, "category_key": key})
+        except DuplicateKeyError:
+            pass
+    await _after_write(after=doc, after_key=key)
+    return doc["_id"]
+
+
+async def _probe_order(task_id: ObjectId, user_id: str, category: str = None):
+    """
+    Split collections to try for `task_id`: the located one alone when the locator
+    knows it, otherwise the category hint first and then the rest.
+    Returns (keys, located).
+    """
+    location = await task_locator.locate(task_id)
+    if location:
+        key, owner = location
+        # Someone else's task: nothing to probe
+        return ([key] if owner == user_id else []), True
+
+    keys = list(ACTIVITY_KEYS)
+    if category:
+        hinted = category_key(category)
+        keys.remove(hinted)
+        keys.insert(0, hinted)
+    return keys, False
+
+
+async def update_activity(task_id: str, user_id: str, update_data: dict, category: str = None):
+    """Apply `$set: update_data` to the user's activity. Returns the updated document or None."""
+    match = {"_id": ObjectId(task_id), "user_id": user_id}
+
+    if is_unified():
+        changes = dict(update_data)
+        if "category" in changes:
+            changes["category_key"] = category_key(changes["category"])
+        # The previous version drives the rollup transition; the new one is derived locally
+        before = await activities_collection.find_one_and_update(match, {"$set": changes})
+        if not before:
+            return None
+        updated = {**before, **changes}
+        await _after_write(before, before.get("category_key"), updated, updated.get("category_key"))
+        return updated
+
+    keys, located = await _probe_order(match["_id"], user_id, category)
+    for key in keys:
+        coll = SPLIT_COLLECTIONS[key]
+        before = await coll.find_one_and_update(match, {"$set": update_data})
+        if before:
+            updated = {**before, **update_data}
+            if not located:
+                await task_locator.remember(match["_id"], key, user_id)
+            if is_dual_write():
+                await _mirror(updated, key)
+            await _after_write(before, key, updated, key)
+            return updated
+
+    if keys and located:
+        # Stale entry: fall back to probing every collection once
+        await task_locator.forget(match["_id"])
+        return await update_activity(task_id, user_id, update_data, category)
+    return None
+
+
+async def delete_activity(task_id: str, user_id: str):
+    """Delete the user's activity. Returns True when something was removed."""
+    match = {"_id": ObjectId(task_id), "user_id": user_id}
+
+    if is_unified():
+        before = await activities_collection.find_one_and_delete(match)
+        if not before:
+            return False
+        await _after_write(before, before.get("category_key"))
+        return True
+
+    keys, located = await _probe_order(match["_id"], user_id)
+    for key in keys:
+        before = await SPLIT_COLLECTIONS[key].find_one_and_delete(match)
+        if before:
+            await task_locator.forget(match["_id"])
+            if is_dual_write():
+                await activities_collection.delete_one(match)
+            await _after_write(before, key)
+            return True
+
+    if keys and located:
+        await task_locator.forget(match["_id"])
+        return await delete_activity(task_id, user_id)
+    return False
+
+
+async def find_by_titles(user_id: str, titles: list):
+    """
+    The user's activities whose title matches one of `titles` (case-insensitive), as
+    {lowercased title: [(doc, category_key), ...]} in display order. One query per source.
+    """
+    patterns = [re.compile(f"^{re.escape(title)}$", re.IGNORECASE) for title in titles]
+    query = {"user_id": user_id, "title": {"$in": patterns}}
+    if is_unified():
+        docs = await activities_collection.find(query).to_list(length=None)
+        pairs = [(doc, doc.get("category_key")) for doc in docs]
+    else:
+        results = await asyncio.gather(*(coll.find(query).to_list(length=None) for coll in SPLIT_COLLECTIONS.values()))
+        pairs = [(doc, key) for key, docs in zip(ACTIVITY_KEYS, results) for doc in docs]
+
+    matches = {}
+    for doc, key in sorted(pairs, key=lambda pair: activity_sort_key(pair[0])):
+        matches.setdefault(doc.get("title", "").lower(), []).append((doc, key))
+    return matches
+
+
+async def insert_activities(docs: list):
+    """Insert many activities with one insert_many per collection. Returns the ObjectIds in order."""
+    if not docs:
+        return []
+    for doc in docs:
+        doc["_id"] = ObjectId()
+    keys = [category_key(doc.get("category")) for doc in docs]
+
+    if is_unified():
+        for doc, key in zip(docs, keys):
+            doc["category_key"] = key
+        await activities_collection.insert_many(docs)
+    else:
+        grouped = {}
+        for doc, key in zip(docs, keys):
+            grouped.setdefault(key, []).append(doc)
+        outcomes = await asyncio.gather(
+            *(SPLIT_COLLECTIONS[key].insert_many(group) for key, group in grouped.items()),
+            return_exceptions=True
+        )
+        # Locator entries only for the collections whose insert went through
+        await task_locator.remember_many([
+            (doc["_id"], key, doc.get("user_id"))
+            for (key, group), outcome in zip(grouped.items(), outcomes) if not isinstance(outcome, Exception)
+            for doc in group
+        ])
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                raise outcome
+        if is_dual_write():
+            try:
+                await activities_collection.insert_many(
+                    [{**doc, "category_key": key} for doc, key in zip(docs, keys)], ordered=False
+                )
+            except BulkWriteError as e:
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+
+    await _after_writes([(None, None, doc, key) for doc, key in zip(docs, keys)])
+    return [doc["_id"] for doc in docs]
+
+
+async def update_activities(changes: list):
+    """
+    Apply many `$set` updates to already-loaded documents: `changes` is a list of
+    (doc, category_key, update_data). One bulk_write per collection. Returns the updated docs.
+    """
+    if not changes:
+        return []
+    grouped = {}
+    updated_docs = []
+    after_changes = []
+    for before, key, update_data in changes:
+        data = dict(update_data)
+        new_key = key
+        if is_unified() and "category" in data:
+            new_key = data["category_key"] = category_key(data["category"])
+        op = UpdateOne({"_id": before["_id"], "user_id": before.get("user_id")}, {"$set": data})
+        grouped.setdefault(key, []).append(op)
+        updated = {**before, **data}
+        updated_docs.append(updated)
+        after_changes.append((before, key, updated, new_key))
+
+    if is_unified():
+        await activities_collection.bulk_write([op for ops in grouped.values() for op in ops], ordered=False)
+    else:
+        await asyncio.gather(*(SPLIT_COLLECTIONS[key].bulk_write(ops, ordered=False) for key, ops in grouped.items()))
+        if is_dual_write():
+            await activities_collection.bulk_write([
+                ReplaceOne({"_id": doc["_id"]}, {**{k: v for k, v in doc.items() if k != "id"}, "category_key": key}, upsert=True)
+                for _, _, doc, key in after_changes
+            ], ordered=False)
+
+    await _after_writes(after_changes)
+    return updated_docs
+
+
+async def delete_activities(targets: list):
+    """Delete many already-loaded documents, given as (doc, category_key). One delete_many per collection."""
+    if not targets:
+        return 0
+    grouped = {}
+    for doc, key in targets:
+        grouped.setdefault(key, []).append(doc["_id"])
+
+    if is_unified():
+        ids = [doc["_id"] for doc, _ in targets]
+        await activities_collection.delete_many({"_id": {"$in": ids}})
+    else:
+        await asyncio.gather(
+            *(SPLIT_COLLECTIONS[key].delete_many({"_id": {"$in": ids}}) for key, ids in grouped.items()),
+            task_locator.forget_many([doc["_id"] for doc, _ in targets])
+        )
+        if is_dual_write():
+            await activities_collection.delete_many({"_id": {"$in": [doc["_id"] for doc, _ in targets]}})
+
+    await _after_writes([(doc, key, None, None) for doc, key in targets])
+    return len(targets)
+
+
+async def facet_by_category(match: dict, branches: dict):
+    """
+    Run exactly one `$facet` aggregation per physical collection, concurrently.
+
+    `branches` maps category_key -> {name: [pipeline stages]}; each branch only sees
+    that category's documents matching `match`. Returns {category_key: {name: [docs]}}.
+    """
+    keys = list(branches)
+    if is_unified():
+        groups = [(activities_collection, keys)]
+    else:
+        groups = [(SPLIT_COLLECTIONS[key], [key]) for key in keys]
+
+    async def run(coll, group_keys):
+        facets = {}
+        for key in group_keys:
+            key_stage = [{"$match": {"category_key": key}}] if is_unified() else []
+            for name, stages in branches[key].items():
+                facets[f"{key}__{name}"] = key_stage + list(stages)
+        _, source_filter = activity_sources(group_keys)[0]
+        pipeline = [{"$match": {**match, **source_filter}}, {"$facet": facets}]
+        docs = await coll.aggregate(pipeline).to_list(length=1)
+        return docs[0] if docs else {}
+
+    results = await asyncio.gather(*(run(coll, group_keys) for coll, group_keys in groups))
+
+    combined = {key: {} for key in keys}
+    for result in results:
+        for field, docs in result.items():
+            key, name = field.split("__", 1)
+            combined[key][name] = docs
+    return combined
@@ -0,0 +1,285 @@
+"""
+Schedule context for the AI assistant.
+
+Instead of shipping every task from a three-year window, the prompt gets full detail
+for the days that matter (today, tomorrow, dates mentioned in the message and the
+coming week) and per-day counts for everything else, within a token budget.
+
+Rendered day blocks, the count summary and the user's (still encrypted) credentials
+are cached per user under the user's schedule version. Passwords are only decrypted
+while the prompt is assembled, so plaintext never sits in the cache. A write in this worker re-renders only the days it
+touched (`note_write`); a version bump from another worker drops the user's entry.
+"""
+import os
+import re
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from services import activity_store
+from services import rollups
+from services.cache import TTLCache
+
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "4000"))
+AI_CONTEXT_DETAIL_DAYS = int(os.getenv("AI_CONTEXT_DETAIL_DAYS", "7"))
+
+# One entry per user: {"version", "days": {day: (body, items)}, "counts", "credentials" (sealed)}
+AI_CONTEXT_CACHE_SIZE = int(os.getenv("AI_CONTEXT_CACHE_SIZE", "1000"))
+AI_CONTEXT_CACHE_TTL = float(os.getenv("AI_CONTEXT_CACHE_TTL", "600"))
+_context_cache = TTLCache(maxsize=AI_CONTEXT_CACHE_SIZE, ttl=AI_CONTEXT_CACHE_TTL)
+
+# Categories the assistant sees (plans are managed separately)
+CONTEXT_KEYS = ["tasks", "work", "meetings", "routines", "personal"]
+# Only what the prompt renders
+CONTEXT_FIELDS = {"title": 1, "date": 1, "start_time": 1, "end_time": 1, "category": 1, "status": 1}
+
+PAST_DAYS = 365
+FUTURE_DAYS = 365 * 2
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+MONTH_PATTERN = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*"
+
+
+def estimate_tokens(text: str):
+    """Rough token count (~4 characters per token) - good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _safe_date(year: int, month: int, day: int):
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def mentioned_dates(text: str, today: date):
+    """Dates referenced in the user's message, in order of appearance (best effort)."""
+    t = (text or "").lower()
+    found = []
+
+    for m in re.finditer(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b", t):
+        found.append(_safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3))))
+    for m in re.finditer(r"\b(\d{1,2})[/.](\d{1,2})[/.](\d{2,4})\b", t):
+        year = int(m.group(3))
+        found.append(_safe_date(year + 2000 if year < 100 else year, int(m.group(2)), int(m.group(1))))
+    for m in re.finditer(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?" + MONTH_PATTERN + r"\b", t):
+        found.append(_safe_date(today.year, MONTHS[m.group(2)], int(m.group(1))))
+    for m in re.finditer(r"\b" + MONTH_PATTERN + r"\s+(\d{1,2})(?:st|nd|rd|th)?\b", t):
+        found.append(_safe_date(today.year, MONTHS[m.group(1)], int(m.group(2))))
+
+    if "day after tomorrow" in t:
+        found.append(today + timedelta(days=2))
+    if re.search(r"\btomorrow\b", t):
+        found.append(today + timedelta(days=1))
+    if re.search(r"\byesterday\b", t):
+        found.append(today - timedelta(days=1))
+    for m in re.finditer(r"\b(next\s+)?(" + "|".join(WEEKDAYS) + r")\b", t):
+        ahead = (WEEKDAYS.index(m.group(2)) - today.weekday()) % 7
+        found.append(today + timedelta(days=ahead + (7 if m.group(1) else 0)))
+    if "next week" in t:
+        monday = today + timedelta(days=7 - today.weekday())
+        found.extend(monday + timedelta(days=i) for i in range(7))
+    if "weekend" in t:
+        saturday = today + timedelta(days=(5 - today.weekday()) % 7)
+        found.extend([saturday, saturday + timedelta(days=1)])
+
+    return [d for d in found if d]
+
+
+def render_task_line(task: dict):
+    return f"- {task.get('start_time', '')} to {task.get('end_time', '')}: {task.get('title', '')} ({task.get('category', '')})\n"
+
+
+def render_day_header(day: str, label: str = None):
+    return f"\n--- Date: {label or day} ({day}) ---\n"
+
+
+def render_day_body(tasks: list):
+    """Task lines of one day, in start time order ("" for an empty day)."""
+    ordered = sorted(tasks, key=lambda x: x.get("start_time") or "23:59")
+    return "".join(render_task_line(task) for task in ordered)
+
+
+def render_day_block(day: str, tasks: list, label: str = None, body: str = None):
+    """One '--- Date: ... ---' block of the schedule context."""
+    body = render_day_body(tasks) if body is None else body
+    if not body:
+        body = f"No tasks scheduled for {(label or day).lower()}.\n"
+    return render_day_header(day, label) + body
+
+
+def render_credentials(credentials: list):
+    """Credential vault block of the prompt (passwords already decrypted)."""
+    if not credentials:
+        return "\n\nCREDENTIAL VAULT CONTEXT:\nThe user's credential vault is empty.\n"
+    return "\n\nCREDENTIAL VAULT CONTEXT:\n" + "".join(
+        f"- Service: {cred.get('service_name', 'Unknown')}, Type: {cred.get('identifier_type', '')}, ID: {cred.get('identifier_value', '')}, Password: {cred.get('password', '')}\n"
+        for cred in credentials
+    )
+
+
+def render_task_list(tasks: list, today: str, tomorrow: str):
+    """Full schedule context for an explicit list of tasks (no budget)."""
+    grouped = defaultdict(list)
+    for task in tasks:
+        grouped[task.get("date", "Unknown")].append(task)
+
+    context = "\n\nUser's Schedule Context (Past 1 Year to Future 2 Years):\n"
+    if not grouped:
+        return context + "The user has no upcoming tasks scheduled.\n"
+
+    # Always ensure today and tomorrow are printed even if empty, for clarity.
+    labels = {today: "TODAY", tomorrow: "TOMORROW"}
+    blocks = [render_day_block(day, [], label) for day, label in labels.items() if day not in grouped]
+    blocks += [render_day_block(day, grouped[day], labels.get(day)) for day in sorted(grouped, key=str)]
+    return context + "".join(blocks)
+
+
+def _render_summary(counts: dict, budget: int):
+    """Per-day counts, or per-month counts when the per-day list does not fit the budget."""
+    if not counts:
+        return ""
+    intro = "\nOther days (item counts only, full details were omitted):\n"
+    lines = [
+        f"- {day}: {c['total']} items ({c['completed']} completed)\n"
+        for day, c in sorted(counts.items())
+    ]
+    text = intro + "".join(lines)
+    if estimate_tokens(text) <= budget:
+        return text
+
+    months = defaultdict(lambda: {"total": 0, "completed": 0})
+    for day, c in counts.items():
+        months[day[:7]]["total"] += c["total"]
+        months[day[:7]]["completed"] += c["completed"]
+    lines = [f"- {month}: {c['total']} items ({c['completed']} completed)\n" for month, c in sorted(months.items())]
+    return intro.replace("item counts", "monthly item counts") + "".join(lines)
+
+
+def _user_entry(user_id: str, version: int = None):
+    """Cache entry for the user's current version (a throwaway one when uncached)."""
+    entry = _context_cache.get(user_id) if version is not None else None
+    if entry is None or entry["version"] != version:
+        entry = {"version": version, "days": {}, "counts": None, "credentials": None}
+        if version is not None:
+            _context_cache.set(user_id, entry)
+    return entry
+
+
+def _still_current(user_id: str, entry: dict, version: int):
+    """False once a write (or eviction) happened while the entry was being filled."""
+    return version is not None and entry["version"] == version and _context_cache.get(user_id) is entry
+
+
+def note_write(user_id: str, version: int, days=(), credentials: bool = False):
+    """
+    A write moved the user to `version`. If the cached entry was at the previous version,
+    only the touched days (and the counts / credential block) are dropped; otherwise the
+    entry is stale in unknown ways and removed.
+    """
+    entry = _context_cache.pop(user_id)
+    if entry is None or entry["version"] != version - 1:
+        return
+    for day in days:
+        entry["days"].pop(day, None)
+    if days:
+        entry["counts"] = None
+    if credentials:
+        entry["credentials"] = None
+    entry["version"] = version
+    _context_cache.set(user_id, entry)
+
+
+def context_cache_stats():
+    return _context_cache.stats()
+
+
+async def credentials_context(user_id: str, load_credentials, decrypt, version: int = None):
+    """
+    Rendered credential block. `load_credentials()` fetches the user's credentials with
+    their passwords still encrypted and runs only on a miss; `decrypt(stored) -> str`
+    opens each password for this render only.
+    """
+    entry = _user_entry(user_id, version)
+    credentials = entry["credentials"]
+    if credentials is None:
+        credentials = await load_credentials()
+        if _still_current(user_id, entry, version):
+            entry["credentials"] = credentials
+    return render_credentials([
+        {**cred, "password": decrypt(cred["password"]) if cred.get("password") else cred.get("password")}
+        for cred in credentials
+    ])
+
+
+async def build_schedule_context(user_id: str, text: str, now: datetime = None, version: int = None):
+    """
+    Rendered schedule context for the prompt, plus size info for logging.
+    Days are given full detail in priority order until the token budget is spent.
+    With `version` (the user's schedule version) unchanged days come from the cache.
+    """
+    now = now or datetime.now()
+    today = now.date()
+    tomorrow = today + timedelta(days=1)
+    window_start = today - timedelta(days=PAST_DAYS)
+    window_end = today + timedelta(days=FUTURE_DAYS)
+
+    priority = [today, tomorrow]
+    priority += [d for d in mentioned_dates(text, today) if window_start <= d <= window_end]
+    priority += [today + timedelta(days=i) for i in range(2, AI_CONTEXT_DETAIL_DAYS + 1)]
+    detail_days = list(dict.fromkeys(d.strftime("%Y-%m-%d") for d in priority))
+
+    entry = _user_entry(user_id, version)
+    missing = [day for day in detail_days if day not in entry["days"]]
+    window = (window_start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d"))
+    need_counts = entry["counts"] is None or entry["counts"][0] != window
+
+    async def no_result():
+        return None
+
+    detailed, counts = await asyncio.gather(
+        activity_store.find_activities({"user_id": user_id, "date": {"$in": missing}}, CONTEXT_KEYS, CONTEXT_FIELDS) if missing else no_result(),
+        rollups.daily_counts(user_id, CONTEXT_KEYS, *window) if need_counts else no_result()
+    )
+    by_day = defaultdict(list)
+    for task in detailed or []:
+        by_day[task.get("date")].append(task)
+    rendered = {day: (render_day_body(by_day.get(day, [])), len(by_day.get(day, []))) for day in missing}
+
+    days = {**entry["days"], **rendered}
+    counts = counts if need_counts else entry["counts"][1]
+    if _still_current(user_id, entry, version):
+        entry["days"].update(rendered)
+        entry["counts"] = (window, counts)
+
+    today_str, tomorrow_str = detail_days[0], detail_days[1]
+    labels = {today_str: "TODAY", tomorrow_str: "TOMORROW"}
+    blocks = {}
+    used = 0
+    for day in detail_days:
+        body, items = days[day]
+        if not items and day not in labels:
+            continue
+        block = render_day_block(day, None, labels.get(day), body)
+        cost = estimate_tokens(block)
+        # Today and tomorrow are always included in full
+        if day in labels or used + cost <= AI_CONTEXT_TOKEN_BUDGET:
+            blocks[day] = block
+            used += cost
+
+    summary_counts = {day: c for day, c in counts.items() if day and day not in blocks}
+    summary = _render_summary(summary_counts, max(AI_CONTEXT_TOKEN_BUDGET - used, 0))
+
+    context = "\n\nUser's Schedule Context (full detail for the days below, counts for other days):\n"
+    context += "".join(blocks[day] for day in sorted(blocks)) + summary
+    info = {
+        "detailed_days": len(blocks),
+        "detailed_items": sum(days[day][1] for day in blocks),
+        "rendered_days": len(missing),
+        "summary_days": len(summary_counts),
+        "tokens": estimate_tokens(context),
+    }
+    return context, info
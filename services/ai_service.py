@@ -1,9 +1,15 @@
 import os
 import json
 import re
+import copy
+import asyncio
 import google.generativeai as genai
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from services.ai_context import render_task_list, render_credentials, estimate_tokens
+from services.llm_backends import create_backend
+from services.cache import TTLCache
+from services.json_stream import ReplyActionParser
 
 load_dotenv()
 
@@ -30,6 +36,20 @@ generate_config = genai.types.GenerationConfig(
 if "1.5" in GEMINI_MODEL or "2.0" in GEMINI_MODEL or "flash" in GEMINI_MODEL:
     generate_config.response_mime_type = "application/json"
 
+# Async model backend (Gemini or a local fake for load tests)
+backend = create_backend(client, generate_config)
+
+# At most this many generations in flight per process; each one is bounded by a timeout
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "60"))
+_llm_slots = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+
+# Answers keyed by (user, normalized input, schedule version, day): a repeated question
+# against an unchanged schedule skips the model. Any task/credential write bumps the version.
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "2000"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "900"))
+_response_cache = TTLCache(maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL)
+
 SYSTEM_PROMPT = """
 You are Dhana, an advanced agentic productivity assistant.
 Your job is to manage a high-fidelity workspace. 
@@ -107,77 +127,91 @@ def clean_json_response(text):
     except:
         return None
 
-async def process_user_input(text: str, context_tasks: list = None, context_credentials: list = None, image_b64: str = None):
-    if not client:
-        return {"reply": "AI Service is offline: GEMINI_API_KEY is missing from the environment variables.", "actions": []}
+def normalize_input(text: str):
+    """Case, whitespace and trailing punctuation don't change the question."""
+    return re.sub(r"\s+", " ", (text or "").lower()).strip().rstrip("?!. ")
 
-    try:
-        if context_tasks is None:
-            context_tasks = []
-        if context_credentials is None:
-            context_credentials = []
-            
-        # Get current date and tomorrow for context
-        now = datetime.now()
-        today_date = now.strftime("%Y-%m-%d")
-        tomorrow_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
-        
-        # Sort and format all tasks dynamically
-        from collections import defaultdict
-        grouped_tasks = defaultdict(list)
-        for t in context_tasks:
-            date_str = t.get("date", "Unknown")
-            grouped_tasks[date_str].append(t)
-            
-        schedule_context = "\n\nUser's Schedule Context (Past 1 Year to Future 2 Years):\n"
-        if not grouped_tasks:
-            schedule_context += "The user has no upcoming tasks scheduled.\n"
-        else:
-            # Always ensure today and tomorrow are printed even if empty, for clarity.
-            if today_date not in grouped_tasks:
-                schedule_context += f"\n--- Date: TODAY ({today_date}) ---\nNo tasks scheduled for today.\n"
-            if tomorrow_date not in grouped_tasks:
-                schedule_context += f"\n--- Date: TOMORROW ({tomorrow_date}) ---\nNo tasks scheduled for tomorrow.\n"
-
-            for d in sorted(grouped_tasks.keys()):
-                label = "TODAY" if d == today_date else "TOMORROW" if d == tomorrow_date else d
-                schedule_context += f"\n--- Date: {label} ({d}) ---\n"
-                for task in sorted(grouped_tasks[d], key=lambda x: x.get("start_time", "23:59")):
-                    schedule_context += f"- {task.get('start_time', '')} to {task.get('end_time', '')}: {task.get('title', '')} ({task.get('category', '')})\n"
+def response_cache_key(user_id: str, text: str, version: int):
+    return (user_id, normalize_input(text), version, datetime.now().strftime("%Y-%m-%d"))
 
+def get_cached_response(cache_key):
+    """A private copy of the cached answer (callers annotate actions), or None."""
+    cached = _response_cache.get(cache_key)
+    return copy.deepcopy(cached) if cached is not None else None
+
+def response_cache_stats():
+    return _response_cache.stats()
+
+async def generate(contents: list):
+    """One model call, limited to AI_MAX_CONCURRENCY in flight per process."""
+    async with _llm_slots:
+        return await backend.generate(contents)
+
+def build_contents(text: str, context_tasks: list = None, context_credentials: list = None, image_b64: str = None, schedule_context: str = None, credentials_context: str = None, image: tuple = None):
+    """
+    Prompt (plus optional image part) for one assistant turn. Pre-rendered context blocks
+    win over the lists; `image` is a prepared (bytes, mime) pair from services.image_service.
+    """
+    if context_tasks is None:
+        context_tasks = []
+    if context_credentials is None:
+        context_credentials = []
         
-        credentials_context = "\n\nCREDENTIAL VAULT CONTEXT:\n"
-        if context_credentials:
-            for cred in context_credentials:
-                credentials_context += f"- Service: {cred.get('service_name', 'Unknown')}, Type: {cred.get('identifier_type', '')}, ID: {cred.get('identifier_value', '')}, Password: {cred.get('password', '')}\n"
-        else:
-            credentials_context += "The user's credential vault is empty.\n"
-        
-        full_prompt = f"{SYSTEM_PROMPT}\n\nIMPORTANT: Today's date is {today_date}.{schedule_context}{credentials_context}\n\nUser Input: {text}"
+    # Get current date and tomorrow for context
+    now = datetime.now()
+    today_date = now.strftime("%Y-%m-%d")
+    tomorrow_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
+    
+    # Callers normally pass a budgeted context from services.ai_context;
+    # otherwise every given task is rendered.
+    if schedule_context is None:
+        schedule_context = render_task_list(context_tasks, today_date, tomorrow_date)
+
+    if credentials_context is None:
+        credentials_context = render_credentials(context_credentials)
+    
+    full_prompt = f"{SYSTEM_PROMPT}\n\nIMPORTANT: Today's date is {today_date}.{schedule_context}{credentials_context}\n\nUser Input: {text}"
+    print(f"DEBUG: AI prompt size: {len(full_prompt)} chars (~{estimate_tokens(full_prompt)} tokens)")
+    
+    # Prepare contents (multimodal)
+    contents = [full_prompt]
+    if image:
+        data, mime = image
+        contents.append({"mime_type": mime, "data": data})
+    elif image_b64:
+        # Handle base64 image (remove prefix if present)
+        if "," in image_b64:
+            image_b64 = image_b64.split(",")[1]
         
-        # Prepare contents (multimodal)
-        contents = [full_prompt]
-        if image_b64:
-            # Handle base64 image (remove prefix if present)
-            if "," in image_b64:
-                image_b64 = image_b64.split(",")[1]
-            
-            import base64
-            contents.append({
-                "mime_type": "image/jpeg",
-                "data": base64.b64decode(image_b64)
-            })
-
-        response = client.generate_content(
-            contents=contents,
-            generation_config=generate_config
-        )
+        import base64
+        contents.append({
+            "mime_type": "image/jpeg",
+            "data": base64.b64decode(image_b64)
+        })
+    return contents
+
+async def process_user_input(text: str, context_tasks: list = None, context_credentials: list = None, image_b64: str = None, schedule_context: str = None, cache_key: tuple = None, credentials_context: str = None, image: tuple = None):
+    if not backend:
+        return {"reply": "AI Service is offline: GEMINI_API_KEY is missing from the environment variables.", "actions": []}
+
+    try:
+        contents = build_contents(text, context_tasks, context_credentials, image_b64, schedule_context, credentials_context, image)
+
+        try:
+            # The timeout also covers waiting for a free slot
+            response_text = await asyncio.wait_for(generate(contents), timeout=AI_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            print(f"AI Error: generation timed out after {AI_TIMEOUT_SECONDS}s")
+            return {"reply": "Sorry, the assistant took too long to respond. Please try again.", "actions": []}
         
-        if not response.text:
+        if not response_text:
             return {"reply": "I'm sorry, I couldn't generate a response.", "tasks": []}
 
-        data = clean_json_response(response.text)
+        data = clean_json_response(response_text)
         if data:
+            # Answers about an image depend on more than the text, never cache those
+            if cache_key and not (image_b64 or image):
+                _response_cache.set(cache_key, copy.deepcopy(data))
             return data
             
         return {"reply": "Sorry, I had trouble formatting the response correctly.", "tasks": []}
@@ -185,3 +219,49 @@ async def process_user_input(text: str, context_tasks: list = None, context_cred
     except Exception as e:
         print(f"AI Error: {e}")
         return {"reply": f"AI Error: {str(e)}", "tasks": []}
+
+async def stream_user_input(text: str, context_credentials: list = None, image_b64: str = None, schedule_context: str = None, cache_key: tuple = None, credentials_context: str = None, image: tuple = None):
+    """
+    Streaming variant of process_user_input. Yields ("reply", text) deltas and
+    ("action", dict) events while the model generates, then ("done", result) with the
+    fully parsed response. The same slot limit and overall timeout apply.
+    """
+    if not backend:
+        yield "done", {"reply": "AI Service is offline: GEMINI_API_KEY is missing from the environment variables.", "actions": []}
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + AI_TIMEOUT_SECONDS
+    parser = ReplyActionParser()
+    try:
+        contents = build_contents(text, None, context_credentials, image_b64, schedule_context, credentials_context, image)
+        await asyncio.wait_for(_llm_slots.acquire(), timeout=AI_TIMEOUT_SECONDS)
+        chunks = backend.generate_stream(contents)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    break
+                for event in parser.feed(chunk):
+                    yield event
+        finally:
+            # Also runs when the client goes away mid-stream
+            _llm_slots.release()
+            await chunks.aclose()
+    except asyncio.TimeoutError:
+        print(f"AI Error: generation timed out after {AI_TIMEOUT_SECONDS}s")
+        yield "done", {"reply": "Sorry, the assistant took too long to respond. Please try again.", "actions": []}
+        return
+    except Exception as e:
+        print(f"AI Error: {e}")
+        yield "done", {"reply": f"AI Error: {str(e)}", "actions": []}
+        return
+
+    data = clean_json_response(parser.buffer)
+    if not data:
+        yield "done", {"reply": "Sorry, I had trouble formatting the response correctly.", "actions": []}
+        return
+    if cache_key and not (image_b64 or image):
+        _response_cache.set(cache_key, copy.deepcopy(data))
+    yield "done", data
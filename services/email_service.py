@@ -1,5 +1,10 @@
 import os
+import time
+import queue
+import asyncio
 import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
@@ -10,6 +15,11 @@ SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+# Persistent connections kept open (each one also gets a sender thread)
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "3"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+# Connections idle for longer than this are checked with NOOP before reuse
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "30"))
 
 def wrap_in_template(content: str, subject: str):
     """Wraps plain text content in a premium HTML template."""
@@ -57,34 +67,197 @@ def wrap_in_template(content: str, subject: str):
     </html>
     """
 
-def send_email(to_email: str, subject: str, body: str, is_html: bool = False):
+def build_message(to_email: str, subject: str, body: str, is_html: bool = False):
+    msg = MIMEMultipart()
+    msg["From"] = f"Dhana Durga <{SMTP_USER}>"
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    
+    # Determine content type
+    content = body
+    if is_html:
+        msg.attach(MIMEText(content, "html"))
+    else:
+        # If not explicitly HTML, we wrap the plain text in our template
+        html_version = wrap_in_template(body, subject)
+        msg.attach(MIMEText(html_version, "html"))
+        # Optional: attach plain text version too for reliability
+        msg.attach(MIMEText(body, "plain"))
+    return msg
+
+
+class SMTPPool:
+    """
+    Up to `size` authenticated SMTP connections, reused across messages.
+
+    A connection idle for longer than `idle_check` seconds is probed with NOOP before
+    reuse; a broken one is replaced and the message retried once. Thread-safe: sends
+    run on the pool's own executor so they never block the event loop.
+    """
+
+    def __init__(self, host: str, port: int, user: str = None, password: str = None,
+                 size: int = 3, starttls: bool = True, timeout: float = 30, idle_check: float = 30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="smtp")
+        self.stats = {"connects": 0, "reconnects": 0, "sent": 0, "failed": 0}
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.user and self.password:
+            server.login(self.user, self.password)
+        self.stats["connects"] += 1
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - idle_since < self.idle_check:
+                    return server
+                try:
+                    if server.noop()[0] == 250:
+                        return server
+                except Exception:
+                    pass
+                self._close(server)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, server, broken: bool = False):
+        if broken:
+            self._close(server)
+        else:
+            self._idle.put((server, time.monotonic()))
+        self._slots.release()
+
+    def _send_on(self, server, msg):
+        """Send on `server`, reconnecting once if it went away. Returns (server, sent)."""
+        try:
+            server.send_message(msg)
+            return server, True
+        except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+            self._close(server)
+            self.stats["reconnects"] += 1
+            server = self._connect()
+            server.send_message(msg)
+            return server, True
+
+    def _fail(self, error, results: list):
+        print(f"Email Error: {error}")
+        self.stats["failed"] += 1
+        results.append(False)
+
+    def send_many(self, messages: list):
+        """
+        Send every message over one pooled connection. Returns a success flag per message.
+        A message the server rejects fails alone; only a lost connection ends the batch.
+        """
+        results = []
+        server = self._acquire()
+        broken = False
+        try:
+            for msg in messages:
+                try:
+                    server, sent = self._send_on(server, msg)
+                    self.stats["sent"] += 1
+                    results.append(sent)
+                except smtplib.SMTPServerDisconnected as e:
+                    # Still gone after the reconnect
+                    self._fail(e, results)
+                    broken = True
+                    break
+                except smtplib.SMTPRecipientsRefused as e:
+                    print(f"Email Error: recipient refused {e.recipients}")
+                    self.stats["failed"] += 1
+                    results.append(False)
+                except smtplib.SMTPException as e:
+                    # Rejected data / sender: this message fails, the connection is still usable
+                    self._fail(e, results)
+                except OSError as e:
+                    # Timeouts and resets (SMTPException is an OSError too, hence the order)
+                    self._fail(e, results)
+                    broken = True
+                    break
+                except Exception as e:
+                    # A message that could not be serialized
+                    self._fail(e, results)
+        finally:
+            self._release(server, broken)
+        return results + [False] * (len(messages) - len(results))
+
+    def send(self, msg):
+        try:
+            return self.send_many([msg])[0]
+        except Exception as e:
+            # Could not even connect
+            print(f"Email Error: {e}")
+            self.stats["failed"] += 1
+            return False
+
+    async def send_async(self, msg):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.send, msg)
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(server)
+
+    def pool_stats(self):
+        return {**self.stats, "idle": self._idle.qsize(), "size": self.size}
+
+
+smtp_pool = SMTPPool(
+    SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASSWORD,
+    size=SMTP_POOL_SIZE, starttls=SMTP_STARTTLS, idle_check=SMTP_IDLE_CHECK_SECONDS
+)
+
+
+def smtp_configured(to_email: str = None):
     if not SMTP_USER or not SMTP_PASSWORD:
         print(f"SMTP not configured. Email to {to_email} skipped.")
         return False
-    
-    try:
-        msg = MIMEMultipart()
-        msg["From"] = f"Dhana Durga <{SMTP_USER}>"
-        msg["To"] = to_email
-        msg["Subject"] = subject
-        
-        # Determine content type
-        content = body
-        if is_html:
-            msg.attach(MIMEText(content, "html"))
-        else:
-            # If not explicitly HTML, we wrap the plain text in our template
-            html_version = wrap_in_template(body, subject)
-            msg.attach(MIMEText(html_version, "html"))
-            # Optional: attach plain text version too for reliability
-            msg.attach(MIMEText(body, "plain"))
-        
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Email Error: {e}")
+    return True
+
+
+def send_email(to_email: str, subject: str, body: str, is_html: bool = False):
+    """Blocking send over a pooled connection (for scripts / threads; use send_email_async in async code)."""
+    if not smtp_configured(to_email):
         return False
+    return smtp_pool.send(build_message(to_email, subject, body, is_html))
+
+
+async def send_email_async(to_email: str, subject: str, body: str, is_html: bool = False):
+    """Awaitable send: the SMTP work runs on the pool's executor, not the event loop."""
+    if not smtp_configured(to_email):
+        return False
+    return await smtp_pool.send_async(build_message(to_email, subject, body, is_html))
+
@@ -0,0 +1,221 @@
+"""
+Images for the vision chat: size-limited streaming upload parsing, real MIME
+detection from magic bytes and downscale/recompression before the model call.
+
+Large phone photos are shrunk to AI_IMAGE_MAX_DIMENSION on the long side and
+re-encoded as JPEG, which is all the model needs to read a note or a schedule.
+"""
+import os
+import io
+import base64
+import binascii
+import asyncio
+from tempfile import SpooledTemporaryFile
+from PIL import Image, ImageOps
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+AI_IMAGE_MAX_BYTES = int(os.getenv("AI_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+AI_IMAGE_MAX_DIMENSION = int(os.getenv("AI_IMAGE_MAX_DIMENSION", "1600"))
+AI_IMAGE_JPEG_QUALITY = int(os.getenv("AI_IMAGE_JPEG_QUALITY", "85"))
+
+CHUNK_SIZE = 64 * 1024
+# Allowance for the text fields and multipart boundaries on top of the image limit
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+# Uploads stay in memory up to this size, then spill to a temp file
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+# Formats Pillow re-encodes; HEIC/HEIF are passed through as-is
+RESIZABLE = {"image/jpeg", "image/png", "image/webp", "image/gif"}
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+class MalformedUpload(Exception):
+    pass
+
+
+def sniff_mime(head: bytes):
+    """MIME type from the file signature, or None when it is not a supported image."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    return None
+
+
+class _UploadForm:
+    """MultipartParser callbacks: text fields into memory, the `file_field` part into a spooled file."""
+
+    def __init__(self, file_field: str, max_bytes: int):
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.file = None
+        self.file_size = 0
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = None
+        self._target = None
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._header_field = self._header_value = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        self._name = options.get(b"name", b"").decode("latin-1")
+        if b"filename" in options and self._name == self.file_field:
+            if self.file is not None:
+                raise MalformedUpload(f"More than one '{self.file_field}' file")
+            self.file = self._target = SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        else:
+            # Text fields (and any other file) are small; the body limit bounds them
+            self._target = bytearray()
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._target is not self.file:
+            self._target.extend(data[start:end])
+            return
+        self.file_size += end - start
+        if self.file_size > self.max_bytes:
+            raise ImageTooLarge(f"Image exceeds {self.max_bytes} bytes")
+        self.file.write(data[start:end])
+
+    def on_part_end(self):
+        if self._target is not self.file:
+            self.fields[self._name] = self._target.decode("utf-8", errors="replace")
+        self._target = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+async def read_upload_form(chunks, content_type: str, file_field: str = "image",
+                           max_bytes: int = AI_IMAGE_MAX_BYTES, overhead: int = UPLOAD_FORM_OVERHEAD):
+    """
+    Parse a multipart/form-data body as it streams in. Returns (fields, spooled file or None).
+    Raises ImageTooLarge as soon as the file part passes `max_bytes` or the whole body
+    passes `max_bytes + overhead`, before the rest is read; MalformedUpload for bad bodies.
+    """
+    ctype, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise MalformedUpload("Expected a multipart/form-data body")
+
+    form = _UploadForm(file_field, max_bytes)
+    parser = MultipartParser(boundary, form.callbacks())
+    received = 0
+    try:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > max_bytes + overhead:
+                raise ImageTooLarge(f"Upload exceeds {max_bytes + overhead} bytes")
+            parser.write(chunk)
+        parser.finalize()
+    except (ImageTooLarge, MalformedUpload):
+        form.close()
+        raise
+    except Exception as e:
+        # python-multipart raises its own parse errors
+        form.close()
+        raise MalformedUpload(f"Invalid multipart body: {e}")
+    if form.file is not None:
+        form.file.seek(0)
+    return form.fields, form.file
+
+
+def decode_base64_image(image_b64: str, max_bytes: int = AI_IMAGE_MAX_BYTES):
+    """Bytes of a (data URL or bare) base64 image, size-checked before decoding."""
+    if "," in image_b64:
+        image_b64 = image_b64.split(",", 1)[1]
+    if len(image_b64) * 3 // 4 > max_bytes:
+        raise ImageTooLarge(f"Image exceeds {max_bytes} bytes")
+    try:
+        return base64.b64decode(image_b64)
+    except (binascii.Error, ValueError):
+        raise UnsupportedImage("Image is not valid base64")
+
+
+def _shrink(fileobj, mime: str):
+    """Downscale to AI_IMAGE_MAX_DIMENSION and re-encode as JPEG. Returns (bytes, mime)."""
+    fileobj.seek(0)
+    original = fileobj.read()
+    if mime not in RESIZABLE:
+        return original, mime
+
+    with Image.open(io.BytesIO(original)) as img:
+        img = ImageOps.exif_transpose(img)
+        resized = max(img.size) > AI_IMAGE_MAX_DIMENSION
+        if resized:
+            img.thumbnail((AI_IMAGE_MAX_DIMENSION, AI_IMAGE_MAX_DIMENSION))
+        if img.mode != "RGB":
+            # JPEG has no alpha: flatten transparent areas onto white
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.split()[3])
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=AI_IMAGE_JPEG_QUALITY, optimize=True)
+
+    data = out.getvalue()
+    # A small image that is already compact is sent unchanged
+    if not resized and len(data) >= len(original):
+        return original, mime
+    return data, "image/jpeg"
+
+
+async def prepare_image(fileobj):
+    """
+    (bytes, mime) ready for the model from a file-like object.
+    Raises UnsupportedImage when the content is not a known image format.
+    """
+    fileobj.seek(0)
+    mime = sniff_mime(fileobj.read(16))
+    if not mime:
+        raise UnsupportedImage("Unsupported image format")
+    try:
+        # Decoding and resampling are CPU bound - keep them off the event loop
+        data, mime_out = await asyncio.to_thread(_shrink, fileobj, mime)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise UnsupportedImage(f"Could not read image: {e}")
+    print(f"DEBUG: Prepared {mime} image for AI: {len(data)} bytes as {mime_out}")
+    return data, mime_out
@@ -0,0 +1,115 @@
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from database import db
+from services.activity_store import ACTIVITY_KEYS
+from services.outbox import OUTBOX_RETENTION_SECONDS
+
+
+def _activity_indexes():
+    return [
+        # Per-user listing / stats: {user_id, date, status}
+        IndexModel(
+            [("user_id", ASCENDING), ("date", ASCENDING), ("status", ASCENDING)],
+            name="user_date_status",
+        ),
+        # Reminder scans: {date, status, start_time range}
+        IndexModel(
+            [("date", ASCENDING), ("status", ASCENDING), ("start_time", ASCENDING)],
+            name="date_status_start_time",
+        ),
+    ]
+
+
+# Declarative registry: collection name -> indexes that must exist
+INDEX_REGISTRY = {
+    **{name: _activity_indexes() for name in ACTIVITY_KEYS},
+    # Unified store: cross-category reads are one index range per category key
+    "activities": [
+        IndexModel(
+            [("user_id", ASCENDING), ("category_key", ASCENDING), ("date", ASCENDING), ("status", ASCENDING)],
+            name="user_category_date_status",
+        ),
+        IndexModel(
+            [("date", ASCENDING), ("status", ASCENDING), ("start_time", ASCENDING)],
+            name="date_status_start_time",
+        ),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "alerts_log": [
+        IndexModel(
+            [("task_id", ASCENDING), ("user_id", ASCENDING), ("method", ASCENDING)],
+            name="task_user_method_unique",
+            unique=True,
+        ),
+    ],
+    "daily_rollups": [
+        IndexModel(
+            [("user_id", ASCENDING), ("category", ASCENDING), ("date", ASCENDING)],
+            name="user_category_date_unique",
+            unique=True,
+        ),
+    ],
+    # Outbox workers claim due jobs and expired leases
+    "notification_outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+        # Settled jobs expire (TTL indexes only take a single date field each)
+        IndexModel([("sent_at", ASCENDING)], name="sent_at_ttl", expireAfterSeconds=OUTBOX_RETENTION_SECONDS),
+        IndexModel([("failed_at", ASCENDING)], name="failed_at_ttl", expireAfterSeconds=OUTBOX_RETENTION_SECONDS),
+    ],
+    "task_locator": [IndexModel([("user_id", ASCENDING)], name="user_id")],
+    "notes": [IndexModel([("user_id", ASCENDING)], name="user_id")],
+    "habits": [IndexModel([("user_id", ASCENDING)], name="user_id")],
+    "credentials": [IndexModel([("user_id", ASCENDING)], name="user_id")],
+}
+
+
+async def ensure_indexes():
+    """Create every index in INDEX_REGISTRY. Safe to run on every startup."""
+    for coll_name, indexes in INDEX_REGISTRY.items():
+        coll = db[coll_name]
+        for index in indexes:
+            try:
+                await coll.create_indexes([index])
+            except OperationFailure as e:
+                # e.g. duplicate emails blocking a unique index - keep booting,
+                # the audit endpoint will report it as missing.
+                print(f"Index Error: {coll_name}.{index.document['name']}: {e}")
+
+
+async def audit_indexes():
+    """Report declared-but-missing, undeclared and unused indexes per collection."""
+    report = {}
+    for coll_name in sorted(set(INDEX_REGISTRY) | set(await db.list_collection_names())):
+        coll = db[coll_name]
+        declared = {index.document["name"]: index.document for index in INDEX_REGISTRY.get(coll_name, [])}
+
+        existing = {}
+        async for index in coll.list_indexes():
+            existing[index["name"]] = index
+
+        usage = {}
+        try:
+            async for stat in coll.aggregate([{"$indexStats": {}}]):
+                usage[stat["name"]] = stat["accesses"]["ops"]
+        except OperationFailure as e:
+            print(f"Index Audit Error: $indexStats on {coll_name}: {e}")
+
+        missing = []
+        for name, spec in declared.items():
+            found = existing.get(name)
+            if not found or dict(found["key"]) != dict(spec["key"]):
+                missing.append({"name": name, "key": dict(spec["key"]), "unique": spec.get("unique", False)})
+
+        undeclared = [name for name in existing if name != "_id_" and name not in declared]
+        unused = [name for name, ops in usage.items() if name != "_id_" and ops == 0]
+
+        report[coll_name] = {
+            "missing": missing,
+            "undeclared": undeclared,
+            "unused": unused,
+            "usage": usage,
+        }
+    return report
@@ -0,0 +1,197 @@
+"""
+Rules-based intent router in front of the LLM.
+
+Deterministic lookups - today's / tomorrow's schedule, free slots and "what's my X
+password" - are answered straight from Mongo in the usual `{reply, actions}` shape.
+Anything that looks like a request to change data, or that the rules are not sure
+about, returns None and goes to the model.
+"""
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from database import credentials_collection
+from services import activity_store
+from services.ai_context import CONTEXT_KEYS, CONTEXT_FIELDS
+
+# Working day used for free slot calculation (same assumption as the system prompt)
+DAY_START = "09:00"
+DAY_END = "21:00"
+
+# Messages that ask for a change always go to the model
+MUTATION_WORDS = re.compile(
+    r"\b(add|create|book|schedule (a|an|my)|set up|move|reschedule|shift|delete|remove|cancel|"
+    r"update|change|rename|remind|mark|complete|save|store|plan a)\b"
+)
+DAY_WORDS = re.compile(r"\b(today|tonight|tomorrow)\b")
+# Any other time reference (weeks, weekdays, explicit dates, ...) needs the model
+OTHER_DAYS = re.compile(
+    r"\b(yesterday|week|weekend|month|year|next|last|ago|overdue|pending|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|"
+    r"jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b|\d{1,2}[/.-]\d{1,2}"
+)
+# Without an explicit day these still clearly mean "today"
+TODAY_PHRASES = re.compile(r"\b(my schedule|my agenda|my day|am i free|free time|free slots?|available slots?|availability)\b")
+# The whole message must be one of these plain lookups. Anything with a qualifier
+# (which / how many / should / done / important, a time like "after 6pm") is left
+# to the model, which can actually answer it.
+WHAT = r"(?:what(?:'s| is| are)|whats|show(?: me)?|give me|tell me|list|get)"
+ON_DAY = r"(?:\s+(?:for|on))?(?:\s+(?:today|tonight|tomorrow))?"
+SCHEDULE_QUERY = re.compile(
+    rf"^(?:(?:{WHAT}\s+)?(?:on\s+)?(?:my|the)\s+(?:schedule|agenda|calendar|day)"
+    rf"|what do i have|what have i got|(?:what'?s|whats) on|am i busy){ON_DAY}$"
+)
+FREE_QUERY = re.compile(
+    rf"^(?:(?:when\s+)?am i (?:free|available)"
+    rf"|(?:do i have|have i got) (?:any )?(?:free time|free slots?|spare time)"
+    rf"|(?:{WHAT}\s+)?(?:my\s+)?(?:free time|free slots?|available slots?|open slots?|availability)){ON_DAY}$"
+)
+PASSWORD_QUERY = re.compile(
+    r"^(?:what(?:'s| is)|whats|show(?: me)?|give(?: me)?|tell(?: me)?|get|send(?: me)?|provide)?\s*(?:me\s+)?"
+    r"(?:my|the)\s+(.+?)\s+password\??$"
+)
+
+_counts = Counter()
+
+
+def _day(text: str, now: datetime):
+    """(label, date) for 'today' / 'tomorrow' in the text, or None when it is not clearly one of them."""
+    if "day after tomorrow" in text or OTHER_DAYS.search(text):
+        return None
+    days = set(m.group(1) for m in DAY_WORDS.finditer(text))
+    if len(days - {"tonight"}) > 1 or (not days and not TODAY_PHRASES.search(text)):
+        return None
+    if "tomorrow" in days:
+        return "TOMORROW", (now + timedelta(days=1)).strftime("%Y-%m-%d")
+    return "TODAY", now.strftime("%Y-%m-%d")
+
+
+def _minutes(hhmm: str):
+    try:
+        hours, minutes = hhmm.split(":")[:2]
+        return int(hours) * 60 + int(minutes)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _hhmm(minutes: int):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def free_slots(tasks: list, start: str = DAY_START, end: str = DAY_END):
+    """[(from, to)] gaps between the timed tasks inside [start, end]."""
+    day_start, day_end = _minutes(start), _minutes(end)
+    busy = sorted(
+        (_minutes(t.get("start_time")), _minutes(t.get("end_time")))
+        for t in tasks
+        if _minutes(t.get("start_time")) is not None and _minutes(t.get("end_time")) is not None
+    )
+    slots = []
+    cursor = day_start
+    for begin, finish in busy:
+        if finish <= cursor:
+            continue
+        if begin > cursor:
+            slots.append((cursor, min(begin, day_end)))
+        cursor = max(cursor, finish)
+        if cursor >= day_end:
+            break
+    if cursor < day_end:
+        slots.append((cursor, day_end))
+    return [(_hhmm(a), _hhmm(b)) for a, b in slots if b > a]
+
+
+def _schedule_lines(tasks: list):
+    return "".join(
+        f"- {t.get('start_time') or '--:--'} to {t.get('end_time') or '--:--'}: {t.get('title', '')} ({t.get('category', '')})\n"
+        for t in tasks
+    )
+
+
+def _schedule_reply(label: str, day: str, tasks: list, free: bool, now: datetime):
+    name = label.lower()
+    if free:
+        start = DAY_START
+        if label == "TODAY":
+            # Nothing before the current time is still available
+            start = max(DAY_START, now.strftime("%H:%M"))
+        slots = free_slots(tasks, start) if start < DAY_END else []
+        if slots:
+            text = f"Your available slots for {name} ({day}), between {DAY_START} and {DAY_END}:\n"
+            text += "".join(f"- {a} to {b}\n" for a, b in slots)
+        else:
+            text = f"You have no free slots left {name} ({day}) between {DAY_START} and {DAY_END}.\n"
+        if tasks:
+            text += f"\nAlready scheduled:\n{_schedule_lines(tasks)}"
+        return text.rstrip()
+
+    if not tasks:
+        return f"You have nothing scheduled for {name} ({day})."
+    return f"Here is your schedule for {name} ({day}):\n{_schedule_lines(tasks)}".rstrip()
+
+
+async def _answer_schedule(text: str, user_id: str, now: datetime):
+    free = bool(FREE_QUERY.match(text))
+    if not (free or SCHEDULE_QUERY.match(text)):
+        return None
+    target = _day(text, now)
+    if not target:
+        return None
+    label, day = target
+    tasks = await activity_store.find_activities({"user_id": user_id, "date": day}, CONTEXT_KEYS, CONTEXT_FIELDS)
+    reply = _schedule_reply(label, day, tasks, free, now)
+    intent = "free_slots" if free else "schedule"
+    return intent, {"reply": reply, "actions": [{"type": "dispatch_schedule", "summary": reply}]}
+
+
+async def _answer_password(text: str, user_id: str, decrypt):
+    match = PASSWORD_QUERY.match(text)
+    if not match:
+        return None
+    service = match.group(1).strip()
+    pattern = re.compile(f"^{re.escape(service)}$", re.IGNORECASE)
+    creds = await credentials_collection.find({"user_id": user_id, "service_name": pattern}).to_list(length=10)
+    # Unknown or ambiguous service names are left to the model
+    if len(creds) != 1 or not creds[0].get("password"):
+        return None
+    cred = creds[0]
+    reply = (
+        f"Your {cred.get('service_name', service)} credentials:\n"
+        f"- {(cred.get('identifier_type') or 'username').capitalize()}: {cred.get('identifier_value', '')}\n"
+        f"- Password: {decrypt(cred['password'])}"
+    )
+    return "password", {"reply": reply, "actions": []}
+
+
+async def route(text: str, user_id: str, decrypt, now: datetime = None):
+    """
+    Local answer for `text`, or None when the LLM should handle it.
+    `decrypt(ciphertext) -> str` opens stored credential passwords.
+    """
+    normalized = re.sub(r"\s+", " ", (text or "").lower()).strip().rstrip("?!. ")
+    if not normalized or MUTATION_WORDS.search(normalized):
+        return None
+    now = now or datetime.now()
+
+    routed = await _answer_password(normalized, user_id, decrypt) or await _answer_schedule(normalized, user_id, now)
+    if not routed:
+        return None
+    intent, result = routed
+    _counts[intent] += 1
+    print(f"DEBUG: Intent router answered '{intent}' for {user_id} without the LLM")
+    return result
+
+
+def record_llm_fallback():
+    _counts["llm"] += 1
+
+
+def router_stats():
+    """Messages answered locally per intent vs sent to the LLM, and the bypass rate."""
+    answered = sum(n for intent, n in _counts.items() if intent != "llm")
+    total = answered + _counts["llm"]
+    return {
+        "answered_locally": answered,
+        "by_intent": {intent: n for intent, n in _counts.items() if intent != "llm"},
+        "llm": _counts["llm"],
+        "bypass_rate": round(answered / total, 4) if total else 0.0,
+    }
@@ -0,0 +1,127 @@
+"""
+Incremental parser for the assistant's `{"reply": "...", "actions": [...]}` output.
+
+Model text is fed in chunks as it streams. `feed` returns the events that became
+available: ("reply", text) for newly decoded characters of the reply string and
+("action", dict) for every action object as soon as its closing brace arrives.
+Anything before the first `{` (e.g. a markdown fence) is ignored.
+"""
+import json
+
+
+class ReplyActionParser:
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.done = False
+        # String scanning
+        self.in_string = False
+        self.string_start = None
+        self.escape = 0            # -1 right after a backslash, else hex digits left in a \uXXXX
+        self.high_surrogate = False
+        # Top-level object state
+        self.expect_key = False
+        self.key = None
+        # Reply streaming: [reply_from, safe_end) is decoded and emitted on each feed
+        self.in_reply = False
+        self.reply_from = None
+        self.safe_end = None
+        # Actions array
+        self.in_actions = False
+        self.action_start = None
+
+    def feed(self, chunk: str):
+        self.buffer += chunk
+        events = []
+        buf = self.buffer
+        while self.pos < len(buf) and not self.done:
+            ch = buf[self.pos]
+            if self.in_string:
+                self._scan_string_char(ch, events)
+            elif self.depth == 0:
+                if ch == "{":
+                    self.depth = 1
+                    self.expect_key = True
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = self.pos
+                if self.depth == 1 and not self.expect_key and self.key == "reply":
+                    self.in_reply = True
+                    self.reply_from = self.safe_end = self.pos + 1
+            elif ch in "{[":
+                if self.depth == 1 and ch == "[" and self.key == "actions":
+                    self.in_actions = True
+                elif self.depth == 2 and ch == "{" and self.in_actions:
+                    self.action_start = self.pos
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 2 and ch == "}" and self.action_start is not None:
+                    events.append(("action", self._load(buf[self.action_start:self.pos + 1])))
+                    self.action_start = None
+                elif self.depth == 1 and ch == "]":
+                    self.in_actions = False
+                elif self.depth == 0:
+                    self.done = True
+            elif self.depth == 1:
+                if ch == ":":
+                    self.expect_key = False
+                elif ch == ",":
+                    self.expect_key = True
+            self.pos += 1
+
+        if self.in_reply:
+            self._emit_reply(events)
+        return [e for e in events if e[1] is not None]
+
+    def _scan_string_char(self, ch: str, events: list):
+        if self.escape:
+            if self.escape == -1:
+                # First character after the backslash
+                self.escape = 4 if ch == "u" else 0
+                unicode_escape = ch == "u"
+            else:
+                self.escape -= 1
+                unicode_escape = True
+            if self.escape == 0:
+                self._escape_done(unicode_escape)
+            return
+        if ch == "\\":
+            self.escape = -1
+            return
+        if ch == '"':
+            self.in_string = False
+            if self.in_reply:
+                self.safe_end = self.pos
+                self._emit_reply(events)
+                self.in_reply = False
+            elif self.depth == 1 and self.expect_key:
+                self.key = self.buffer[self.string_start + 1:self.pos]
+            return
+        if self.in_reply:
+            self.high_surrogate = False
+            self.safe_end = self.pos + 1
+
+    def _escape_done(self, unicode_escape: bool):
+        if not self.in_reply:
+            return
+        # Hold a \uD8xx high surrogate back until its low half has arrived
+        code = self.buffer[self.pos - 3:self.pos + 1].lower() if unicode_escape else ""
+        self.high_surrogate = "d800" <= code <= "dbff"
+        if not self.high_surrogate:
+            self.safe_end = self.pos + 1
+
+    def _emit_reply(self, events: list):
+        if self.safe_end > self.reply_from:
+            text = self._load('"' + self.buffer[self.reply_from:self.safe_end] + '"')
+            if text:
+                events.append(("reply", text))
+            self.reply_from = self.safe_end
+
+    @staticmethod
+    def _load(raw: str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
@@ -0,0 +1,68 @@
+"""
+Pluggable LLM backends for the assistant. Every backend is fully async so a slow
+generation never blocks the event loop.
+
+AI_BACKEND=gemini (default) talks to Gemini; AI_BACKEND=fake answers locally after
+AI_FAKE_LATENCY_MS, for load tests that should not spend quota.
+"""
+import os
+import json
+import asyncio
+
+
+class GeminiBackend:
+    def __init__(self, model, generation_config):
+        self.model = model
+        self.generation_config = generation_config
+
+    async def generate(self, contents: list):
+        response = await self.model.generate_content_async(
+            contents=contents,
+            generation_config=self.generation_config
+        )
+        return response.text
+
+    async def generate_stream(self, contents: list):
+        """Yield the response text chunk by chunk as Gemini produces it."""
+        response = await self.model.generate_content_async(
+            contents=contents,
+            generation_config=self.generation_config,
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend:
+    """Deterministic local model: waits, then echoes the user input in the expected JSON shape."""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+
+    def _reply(self, contents: list):
+        prompt = contents[0] if contents and isinstance(contents[0], str) else ""
+        user_input = prompt.rsplit("User Input:", 1)[-1].strip()
+        return json.dumps({"reply": f"(fake model) You said: {user_input}", "actions": []})
+
+    async def generate(self, contents: list):
+        await asyncio.sleep(self.latency)
+        return self._reply(contents)
+
+    async def generate_stream(self, contents: list, chunk_size: int = 16):
+        """Same answer, spread over the latency in small chunks."""
+        text = self._reply(contents)
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield chunk
+
+
+def create_backend(model=None, generation_config=None):
+    """Backend selected by AI_BACKEND, or None when Gemini is requested but not configured."""
+    name = os.getenv("AI_BACKEND", "gemini").strip().lower()
+    if name == "fake":
+        return FakeBackend(float(os.getenv("AI_FAKE_LATENCY_MS", "500")))
+    if model is None:
+        return None
+    return GeminiBackend(model, generation_config)
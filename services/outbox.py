@@ -0,0 +1,262 @@
+"""
+Durable notification outbox.
+
+Producers (chat dispatch, forgot-password, scheduler jobs) only `enqueue_email` /
+`enqueue_whatsapp` (or `enqueue_many` for a batch) into the `notification_outbox`
+collection and return. A small pool of async workers claims jobs with a `find_one_and_update` lease, sends them and
+retries failures with exponential backoff; after OUTBOX_MAX_ATTEMPTS a job is marked
+`dead` and kept for inspection. A worker that dies mid-send leaves an expired lease
+that any worker will pick up again.
+
+WhatsApp jobs are handed to the rate-limited dispatcher and settled from a task
+when their (possibly merged) message goes out, so a worker is never parked for the
+merge window; at most OUTBOX_WHATSAPP_IN_FLIGHT are held there at once.
+
+Payloads carrying secrets (vault passwords, reset links) are Fernet-sealed at
+enqueue time and only opened by the worker that sends them. Once a job is sent its
+payload is replaced by a digest; dead jobs keep theirs. Settled jobs expire after
+OUTBOX_RETENTION_DAYS through TTL indexes.
+
+Job states: pending -> processing -> sent | pending (retry) | dead
+"""
+import os
+import json
+import random
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from database import notification_outbox_collection
+from services.email_service import send_email_async
+from services.whatsapp_dispatcher import submit_whatsapp
+from services import vault
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "10"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+# Idle workers re-check the collection this often (jobs from other processes)
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+# WhatsApp jobs held by the dispatcher at once (merge window + rate limit). Keep
+# it well under rate * lease so handed-off jobs settle before their lease expires.
+OUTBOX_WHATSAPP_IN_FLIGHT = int(os.getenv("OUTBOX_WHATSAPP_IN_FLIGHT", "200"))
+# How long shutdown waits for handed-off WhatsApp jobs to settle
+OUTBOX_SHUTDOWN_GRACE_SECONDS = 10
+# Sent / dead jobs are deleted this long after they settle
+OUTBOX_RETENTION_SECONDS = int(float(os.getenv("OUTBOX_RETENTION_DAYS", "7")) * 86400)
+
+_wakeup = None
+_workers = []
+_whatsapp_in_flight = set()
+_counts = {"enqueued": 0, "sent": 0, "retried": 0, "dead": 0}
+
+
+def _job(channel: str, payload: dict, now: datetime):
+    return {
+        "channel": channel,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+def _wake():
+    if _wakeup:
+        _wakeup.set()
+
+
+async def _enqueue(channel: str, payload: dict):
+    result = await notification_outbox_collection.insert_one(_job(channel, payload, datetime.utcnow()))
+    _counts["enqueued"] += 1
+    _wake()
+    return result.inserted_id
+
+
+def _seal(payload: dict, sensitive: bool):
+    return {"sealed": vault.encrypt(json.dumps(payload))} if sensitive else payload
+
+
+def _open(payload: dict):
+    return json.loads(vault.decrypt(payload["sealed"])) if "sealed" in payload else payload
+
+
+def _digest(payload: dict):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def email_job(to_email: str, subject: str, body: str, is_html: bool = False, sensitive: bool = False):
+    return "email", _seal({"to": to_email, "subject": subject, "body": body, "is_html": is_html}, sensitive)
+
+
+def whatsapp_job(to_number: str, text: str, sensitive: bool = False):
+    return "whatsapp", _seal({"to": to_number, "text": text}, sensitive)
+
+
+async def enqueue_email(to_email: str, subject: str, body: str, is_html: bool = False, sensitive: bool = False):
+    """`sensitive=True` stores the payload encrypted (passwords, reset links)."""
+    return await _enqueue(*email_job(to_email, subject, body, is_html, sensitive))
+
+
+async def enqueue_whatsapp(to_number: str, text: str, sensitive: bool = False):
+    return await _enqueue(*whatsapp_job(to_number, text, sensitive))
+
+
+async def enqueue_many(jobs: list):
+    """Queue many `email_job` / `whatsapp_job` tuples with one insert_many."""
+    if not jobs:
+        return []
+    now = datetime.utcnow()
+    result = await notification_outbox_collection.insert_many([_job(channel, payload, now) for channel, payload in jobs])
+    _counts["enqueued"] += len(jobs)
+    _wake()
+    return result.inserted_ids
+
+
+async def _send(job: dict):
+    payload = _open(job["payload"])
+    if job["channel"] == "email":
+        return await send_email_async(payload["to"], payload["subject"], payload["body"], payload.get("is_html", False))
+    if job["channel"] == "whatsapp":
+        return await submit_whatsapp(payload["to"], payload["text"])
+    raise ValueError(f"Unknown outbox channel {job['channel']}")
+
+
+async def claim(channels: list = None):
+    """Atomically lease the next due job (or one whose lease expired), optionally only on `channels`. None when idle."""
+    now = datetime.utcnow()
+    query = {"$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now}},
+        {"status": "processing", "lease_until": {"$lt": now}},
+    ]}
+    if channels:
+        query["channel"] = {"$in": channels}
+    return await notification_outbox_collection.find_one_and_update(
+        query,
+        {"$set": {"status": "processing", "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)},
+         "$inc": {"attempts": 1}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def backoff(attempts: int):
+    """Exponential delay with jitter before attempt `attempts + 1`."""
+    delay = min(OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def process(job: dict):
+    try:
+        ok = await _send(job)
+        error = None if ok else "send returned False"
+    except Exception as e:
+        ok, error = False, str(e)
+
+    now = datetime.utcnow()
+    # Only the lease holder may settle the job
+    match = {"_id": job["_id"], "status": "processing", "attempts": job["attempts"]}
+    if ok:
+        # Delivered jobs keep a digest, never the message itself
+        update = {"$set": {"status": "sent", "sent_at": now, "payload_digest": _digest(job["payload"])},
+                  "$unset": {"lease_until": "", "last_error": "", "payload": ""}}
+        _counts["sent"] += 1
+    elif job["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+        # Dead jobs keep their (still sealed) payload for inspection or a re-queue
+        update = {"$set": {"status": "dead", "failed_at": now, "last_error": error},
+                  "$unset": {"lease_until": ""}}
+        _counts["dead"] += 1
+        print(f"Outbox: {job['channel']} job {job['_id']} is dead after {job['attempts']} attempts: {error}")
+    else:
+        next_attempt = now + timedelta(seconds=backoff(job["attempts"]))
+        update = {"$set": {"status": "pending", "next_attempt_at": next_attempt, "last_error": error},
+                  "$unset": {"lease_until": ""}}
+        _counts["retried"] += 1
+    await notification_outbox_collection.update_one(match, update)
+
+
+def _hand_off(job: dict):
+    """
+    WhatsApp jobs wait in the dispatcher for their merge window and rate-limit slot;
+    settle them from a task so the worker can claim the next job meanwhile.
+    """
+    task = asyncio.create_task(process(job))
+    _whatsapp_in_flight.add(task)
+
+    def done(task):
+        _whatsapp_in_flight.discard(task)
+        _wake()
+
+    task.add_done_callback(done)
+
+
+async def _idle(timeout: float):
+    # asyncio.wait rather than wait_for: on 3.11 wait_for can swallow a cancel that
+    # races with the event being set, leaving stop_workers waiting forever
+    waiter = asyncio.ensure_future(_wakeup.wait())
+    try:
+        await asyncio.wait({waiter}, timeout=timeout)
+    finally:
+        waiter.cancel()
+
+
+async def _worker(number: int):
+    while True:
+        try:
+            # With the dispatcher full, keep delivering email instead of blocking
+            channels = ["email"] if len(_whatsapp_in_flight) >= OUTBOX_WHATSAPP_IN_FLIGHT else None
+            job = await claim(channels)
+            if job:
+                if job["channel"] == "whatsapp":
+                    _hand_off(job)
+                else:
+                    await process(job)
+                continue
+            # Nothing due: sleep until a local enqueue or the next poll
+            _wakeup.clear()
+            await _idle(OUTBOX_POLL_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Outbox worker {number} error: {e}")
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+
+def start_workers(count: int = OUTBOX_WORKERS):
+    global _wakeup
+    if _workers:
+        return
+    _wakeup = asyncio.Event()
+    _workers.extend(asyncio.create_task(_worker(i)) for i in range(count))
+    print(f"Outbox: started {count} workers")
+
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    # Handed-off WhatsApp jobs still unsettled after the grace period keep their lease
+    if _whatsapp_in_flight:
+        await asyncio.wait(list(_whatsapp_in_flight), timeout=OUTBOX_SHUTDOWN_GRACE_SECONDS)
+
+
+async def queue_stats():
+    """Jobs per status (queue depth = pending + processing), oldest due job and worker counters."""
+    by_status = {}
+    async for row in notification_outbox_collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        by_status[row["_id"]] = row["count"]
+    oldest = await notification_outbox_collection.find_one(
+        {"status": "pending"}, {"next_attempt_at": 1}, sort=[("next_attempt_at", 1)]
+    )
+    lag = (datetime.utcnow() - oldest["next_attempt_at"]).total_seconds() if oldest else 0.0
+    return {
+        "by_status": by_status,
+        "depth": by_status.get("pending", 0) + by_status.get("processing", 0),
+        "oldest_due_seconds": round(max(lag, 0.0), 1),
+        "workers": len(_workers),
+        "whatsapp_in_flight": len(_whatsapp_in_flight),
+        "counters": dict(_counts),
+    }
@@ -0,0 +1,220 @@
+"""
+In-memory reminder engine.
+
+Today's pending timed activities are loaded once into a min-heap keyed by fire time:
+email at `start_time - reminder_time` minutes (the TaskBase field, default 10) and
+WhatsApp at `start_time - WHATSAPP_REMINDER_MINUTES`. Store writes reschedule the
+affected tasks in place (`note_changes`, called from activity_store), so the runner
+only wakes for reminders that are actually due instead of rescanning every
+collection each minute.
+
+Nothing is skipped when a wake-up is late: everything whose fire time has passed is
+handed over on the next pass, as long as the task has not started yet. That also
+covers reminders that came due while the process was down. A periodic `resync`
+picks up writes made by other processes; the handler is expected to de-duplicate
+against alerts_log.
+"""
+import os
+import heapq
+import asyncio
+import itertools
+from datetime import datetime, timedelta
+from services import activity_store
+
+REMINDER_KEYS = ["tasks", "work", "meetings", "routines", "personal"]
+REMINDER_FIELDS = {"user_id": 1, "title": 1, "category": 1, "date": 1, "start_time": 1, "status": 1, "reminder_time": 1}
+DEFAULT_REMINDER_MINUTES = 10
+WHATSAPP_REMINDER_MINUTES = int(os.getenv("WHATSAPP_REMINDER_MINUTES", "20"))
+REMINDER_RESYNC_MINUTES = int(os.getenv("REMINDER_RESYNC_MINUTES", "15"))
+# Upper bound on a single sleep, so a day change or clock jump is noticed
+MAX_SLEEP_SECONDS = 60
+
+_heap = []          # (fire_at, seq, task_id, method) - may hold stale entries
+_entries = {}       # (task_id, method) -> (fire_at, task); the source of truth
+_seq = itertools.count()
+_day = None
+_replay = None      # changes seen while a load is in flight
+_wakeup = None
+_runner = None
+_handler = None
+_counts = {"loaded": 0, "fired": 0, "overdue": 0, "resyncs": 0}
+
+
+def start_at(task: dict):
+    """Start of the task as a datetime, or None when it has no usable date / start_time."""
+    try:
+        return datetime.strptime(f"{task['date']} {task['start_time'][:5]}", "%Y-%m-%d %H:%M")
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def minutes_until(task: dict, now: datetime = None):
+    start = start_at(task)
+    if not start:
+        return None
+    return max(int((start - (now or datetime.now())).total_seconds() // 60), 0)
+
+
+def reminder_lead(task: dict):
+    """Minutes before the start for the email reminder; bad or missing values use the default."""
+    try:
+        lead = int(task.get("reminder_time"))
+    except (TypeError, ValueError):
+        return DEFAULT_REMINDER_MINUTES
+    return lead if lead >= 0 else DEFAULT_REMINDER_MINUTES
+
+
+def still_matches(snapshot: dict, fresh: dict):
+    """True while the stored task still has the status, date and start_time the reminder was queued for."""
+    return bool(fresh) and all(fresh.get(field) == snapshot.get(field) for field in ("status", "date", "start_time"))
+
+
+def fire_times(task: dict):
+    """[(method, fire_at)] for a pending timed task of the loaded day."""
+    if task.get("status") != "Pending" or task.get("date") != _day:
+        return []
+    start = start_at(task)
+    if not start:
+        return []
+    lead = reminder_lead(task)
+    return [
+        ("email", start - timedelta(minutes=lead)),
+        ("whatsapp", start - timedelta(minutes=WHATSAPP_REMINDER_MINUTES)),
+    ]
+
+
+def _drop(task_id: str):
+    # Heap entries are left behind and skipped when popped
+    for method in ("email", "whatsapp"):
+        _entries.pop((task_id, method), None)
+
+
+def _schedule(task: dict, now: datetime):
+    task_id = str(task["_id"])
+    _drop(task_id)
+    start = start_at(task)
+    # Until the start minute is over the reminder is still worth sending
+    if not start or start < now.replace(second=0, microsecond=0):
+        return
+    for method, fire_at in fire_times(task):
+        _entries[(task_id, method)] = (fire_at, task)
+        heapq.heappush(_heap, (fire_at, next(_seq), task_id, method))
+
+
+def note_changes(changes: list):
+    """Apply activity writes [(before, before_key, after, after_key)] to the queue."""
+    if _replay is not None:
+        _replay.extend(changes)
+    if _day is None:
+        return
+    now = datetime.now()
+    for before, _, after, _ in changes:
+        if before:
+            _drop(str(before["_id"]))
+        if after and after.get("_id"):
+            _schedule(after, now)
+    if _wakeup:
+        _wakeup.set()
+
+
+async def load(now: datetime = None):
+    """(Re)build the queue from today's pending timed activities."""
+    global _day, _replay
+    now = now or datetime.now()
+    day = now.strftime("%Y-%m-%d")
+    _replay = []
+    try:
+        tasks = await activity_store.find_activities(
+            {"date": day, "status": "Pending", "start_time": {"$nin": [None, ""]}},
+            REMINDER_KEYS, REMINDER_FIELDS
+        )
+    finally:
+        replay, _replay = _replay, None
+
+    _day = day
+    _heap.clear()
+    _entries.clear()
+    for task in tasks:
+        _schedule(task, now)
+    # Writes that landed while the query was running win over what it returned
+    note_changes(replay)
+    _counts["loaded"] = len(tasks)
+    print(f"DEBUG: Reminder engine loaded {len(tasks)} activities for {day}, {len(_entries)} reminders queued")
+
+
+async def resync():
+    _counts["resyncs"] += 1
+    await load()
+
+
+def pop_due(now: datetime = None):
+    """Remove and return every reminder whose fire time has passed: [(task, method)]."""
+    now = now or datetime.now()
+    due = []
+    while _heap and _heap[0][0] <= now:
+        fire_at, _, task_id, method = heapq.heappop(_heap)
+        entry = _entries.get((task_id, method))
+        if not entry or entry[0] != fire_at:
+            continue
+        del _entries[(task_id, method)]
+        if now - fire_at > timedelta(seconds=MAX_SLEEP_SECONDS):
+            _counts["overdue"] += 1
+        due.append((entry[1], method))
+    return due
+
+
+async def _run():
+    while True:
+        try:
+            now = datetime.now()
+            if _day != now.strftime("%Y-%m-%d"):
+                await load(now)
+            due = pop_due(now)
+            if due:
+                _counts["fired"] += len(due)
+                await _handler(due)
+            # Sleep until the next reminder, a write that may move it, or the cap
+            timeout = MAX_SLEEP_SECONDS
+            if _heap:
+                timeout = min(timeout, max((_heap[0][0] - datetime.now()).total_seconds(), 0))
+            _wakeup.clear()
+            # asyncio.wait rather than wait_for, which can swallow a cancel on 3.11
+            waiter = asyncio.ensure_future(_wakeup.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=timeout)
+            finally:
+                waiter.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Reminder engine error: {e}")
+            await asyncio.sleep(MAX_SLEEP_SECONDS)
+
+
+def start(handler):
+    """Run the engine; `async handler([(task, method)])` delivers due reminders."""
+    global _runner, _wakeup, _handler
+    if _runner:
+        return
+    _handler = handler
+    _wakeup = asyncio.Event()
+    _runner = asyncio.create_task(_run())
+
+
+async def stop():
+    global _runner
+    if _runner:
+        _runner.cancel()
+        await asyncio.gather(_runner, return_exceptions=True)
+        _runner = None
+
+
+def reminder_stats():
+    upcoming = min((fire_at for fire_at, _ in _entries.values()), default=None)
+    return {
+        "day": _day,
+        "queued": len(_entries),
+        "heap_size": len(_heap),
+        "next_fire_at": upcoming.isoformat() if upcoming else None,
+        **_counts,
+    }
@@ -0,0 +1,230 @@
+"""
+Per-user daily rollups: one `daily_rollups` document per (user_id, date, category)
+holding total / completed / pending counters.
+
+The activity store keeps them current with `$inc` on every create, update and
+delete, so stats can read O(days) rollup rows instead of O(tasks) documents.
+Backfill or repair with:
+
+    python -m services.rollups rebuild [--user USER_ID]
+"""
+import os
+import argparse
+import asyncio
+from pymongo import UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from database import daily_rollups_collection
+from services import activity_store
+
+# Serve /stats from rollups instead of raw documents (enable once backfilled)
+STATS_FROM_ROLLUPS = os.getenv("STATS_FROM_ROLLUPS", "false").lower() in ("1", "true", "yes")
+# Passes over buckets that took a live update while the rebuild was computing them
+REBUILD_ATTEMPTS = 5
+
+
+def _contribution(doc: dict):
+    status = doc.get("status")
+    return {
+        "total": 1,
+        "completed": 1 if status == "Completed" else 0,
+        "pending": 1 if status == "Pending" else 0,
+    }
+
+
+async def apply_change(before: dict = None, before_key: str = None, after: dict = None, after_key: str = None):
+    """
+    Move one document's contribution from its old (date, category) bucket to the new one.
+    Pass `before` alone for a delete, `after` alone for an insert.
+    """
+    await apply_changes([(before, before_key, after, after_key)])
+
+
+async def apply_changes(changes: list):
+    """Batch of (before, before_key, after, after_key) changes, netted per bucket into one bulk_write."""
+    deltas = {}
+    for before, before_key, after, after_key in changes:
+        for doc, key, sign in ((before, before_key, -1), (after, after_key, 1)):
+            if not doc:
+                continue
+            bucket = deltas.setdefault((doc.get("user_id"), doc.get("date"), key), {"total": 0, "completed": 0, "pending": 0})
+            for field, value in _contribution(doc).items():
+                bucket[field] += sign * value
+
+    # `seq` counts the updates a row took, so a rebuild can tell it changed underneath
+    writes = [
+        UpdateOne(
+            {"user_id": user_id, "date": date, "category": key},
+            {"$inc": {**counters, "seq": 1}},
+            upsert=True
+        )
+        for (user_id, date, key), counters in deltas.items()
+        if any(counters.values())
+    ]
+    if writes:
+        await daily_rollups_collection.bulk_write(writes, ordered=False)
+
+
+async def fetch_rows(user_id: str, keys, start: str = None, end: str = None):
+    """Rollup rows for the user's categories, optionally limited to [start, end]."""
+    query = {"user_id": user_id, "category": {"$in": list(keys)}}
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = start
+        if end:
+            query["date"]["$lte"] = end
+    projection = {"_id": 0, "date": 1, "category": 1, "total": 1, "completed": 1, "pending": 1}
+    return await daily_rollups_collection.find(query, projection).to_list(length=None)
+
+
+async def daily_counts(user_id: str, keys, start: str, end: str):
+    """
+    {date: {"total", "completed"}} for [start, end]: from the rollup rows when
+    STATS_FROM_ROLLUPS is set, otherwise one $group-by-date per source, concurrently.
+    """
+    if STATS_FROM_ROLLUPS:
+        counts = {}
+        for row in await fetch_rows(user_id, keys, start, end):
+            day = counts.setdefault(row.get("date"), {"total": 0, "completed": 0})
+            day["total"] += row.get("total", 0)
+            day["completed"] += row.get("completed", 0)
+        return counts
+
+    def pipeline_for(source_filter):
+        return [
+            {"$match": {**source_filter, "user_id": user_id, "date": {"$gte": start, "$lte": end}}},
+            {"$group": {
+                "_id": "$date",
+                "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": [{"$eq": ["$status", "Completed"]}, 1, 0]}}
+            }}
+        ]
+
+    results = await asyncio.gather(*(
+        coll.aggregate(pipeline_for(source_filter)).to_list(length=None)
+        for coll, source_filter in activity_store.activity_sources(keys)
+    ))
+
+    counts = {}
+    for docs in results:
+        for doc in docs:
+            day = counts.setdefault(doc["_id"], {"total": 0, "completed": 0})
+            day["total"] += doc["total"]
+            day["completed"] += doc["completed"]
+    return counts
+
+
+def _bucket(row: dict):
+    return row.get("user_id"), row.get("date"), row.get("category")
+
+
+def _bucket_filter(bucket: tuple):
+    user_id, date, category = bucket
+    return {"user_id": user_id, "date": date, "category": category}
+
+
+async def _row_versions(match: dict):
+    """{bucket: seq} for the existing rollup rows matching `match` (seq None on rows that predate it)."""
+    rows = await daily_rollups_collection.find(match, {"user_id": 1, "date": 1, "category": 1, "seq": 1}).to_list(length=None)
+    return {_bucket(row): row.get("seq") for row in rows}
+
+
+async def _aggregate(match: dict):
+    """{bucket: counters} computed from the raw activities matching `match`."""
+    async def group_source(coll, source_filter, key):
+        # In unified mode the category comes from the document, otherwise from the collection
+        category = "$category_key" if activity_store.is_unified() else {"$literal": key}
+        pipeline = [
+            {"$match": {**match, **source_filter}},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "date": "$date", "category": category},
+                "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": [{"$eq": ["$status", "Completed"]}, 1, 0]}},
+                "pending": {"$sum": {"$cond": [{"$eq": ["$status", "Pending"]}, 1, 0]}}
+            }}
+        ]
+        return await coll.aggregate(pipeline).to_list(length=None)
+
+    keys = activity_store.ACTIVITY_KEYS
+    if activity_store.is_unified():
+        groups = [group_source(coll, f, None) for coll, f in activity_store.activity_sources(keys)]
+    else:
+        groups = [group_source(coll, f, key) for key in keys for coll, f in activity_store.activity_sources([key])]
+    results = await asyncio.gather(*groups)
+    return {
+        _bucket(doc["_id"]): {"total": doc["total"], "completed": doc["completed"], "pending": doc["pending"]}
+        for docs in results for doc in docs
+    }
+
+
+async def _write_buckets(buckets: list, counts: dict, versions: dict):
+    """
+    Replace each bucket's row only if its `seq` is still the one read before the
+    aggregation; buckets missing from `counts` are zeroed and then deleted the same
+    way. Returns the buckets that took a live update meanwhile.
+    """
+    writes = []
+    for bucket in buckets:
+        seq = versions.get(bucket)
+        row = {**_bucket_filter(bucket), "total": 0, "completed": 0, "pending": 0, **counts.get(bucket, {}), "seq": (seq or 0) + 1}
+        # A changed (or newly created) row no longer matches the filter, so the upsert
+        # runs into the unique index instead of overwriting the live update
+        writes.append(ReplaceOne({**_bucket_filter(bucket), "seq": seq}, row, upsert=True))
+    conflicts = set()
+    if writes:
+        try:
+            await daily_rollups_collection.bulk_write(writes, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    raise
+                conflicts.add(buckets[error["index"]])
+
+    # Buckets without activities left: delete unless an update landed after the zeroing
+    removals = [
+        DeleteOne({**_bucket_filter(bucket), "seq": (versions.get(bucket) or 0) + 1})
+        for bucket in buckets if bucket not in counts and bucket not in conflicts
+    ]
+    if removals:
+        await daily_rollups_collection.bulk_write(removals, ordered=False)
+    return conflicts
+
+
+async def rebuild(user_id: str = None):
+    """
+    Recompute rollups from the raw activities (all users, or one) without losing
+    the live $inc updates: every row is replaced conditionally on the `seq` it had
+    before the aggregation, and buckets that changed meanwhile are re-read and
+    recomputed.
+    """
+    match = {"user_id": user_id} if user_id else {}
+    versions = await _row_versions(match)
+    counts = await _aggregate(match)
+    buckets = list(set(counts) | set(versions))
+    rebuilt = len(counts)
+
+    for _ in range(REBUILD_ATTEMPTS):
+        conflicts = await _write_buckets(buckets, counts, versions)
+        if not conflicts:
+            break
+        # Recompute only the users / days that were written to meanwhile
+        narrowed = {"user_id": {"$in": list({b[0] for b in conflicts})}, "date": {"$in": list({b[1] for b in conflicts})}}
+        versions, counts = await asyncio.gather(_row_versions(narrowed), _aggregate(narrowed))
+        buckets = list(conflicts)
+    else:
+        print(f"Rollup rebuild gave up on {len(conflicts)} busy buckets, run it again")
+
+    print(f"Rebuilt {rebuilt} rollup rows" + (f" for user {user_id}" if user_id else ""))
+    return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the daily_rollups collection")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", default=None, help="Only rebuild this user_id")
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.user))
+
+
+if __name__ == "__main__":
+    main()
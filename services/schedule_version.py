@@ -0,0 +1,26 @@
+"""
+Per-user schedule/credential version, stored as `schedule_version` on the user document.
+
+Every write to a user's activities or credentials bumps it, so anything derived
+from that data (AI responses, rendered prompt context) can be cached under the
+version and is invalidated across all workers by the next write.
+"""
+from bson import ObjectId
+from pymongo import ReturnDocument
+from database import users_collection
+
+
+async def current(user_id: str):
+    user = await users_collection.find_one({"_id": ObjectId(user_id)}, {"schedule_version": 1})
+    return (user or {}).get("schedule_version", 0)
+
+
+async def bump(user_id: str):
+    """Increment and return the user's schedule version."""
+    user = await users_collection.find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$inc": {"schedule_version": 1}},
+        projection={"schedule_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return (user or {}).get("schedule_version", 0)
@@ -1,103 +1,108 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime, timedelta
+from datetime import datetime
 import asyncio
-from database import (
-    tasks_collection, work_collection, 
-    meeting_collection, routine_collection,
-    personal_collection,
-    users_collection, alerts_log_collection
-)
-from services.email_service import send_email
-from services.whatsapp_service import send_whatsapp_message
+from database import users_collection, alerts_log_collection
+from services.activity_store import find_activities
+from services import reminders
+from services.outbox import enqueue_email, enqueue_whatsapp, enqueue_many, email_job, whatsapp_job
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
 
 scheduler = AsyncIOScheduler()
-activity_collections = [tasks_collection, work_collection, meeting_collection, routine_collection, personal_collection]
+activity_keys = ["tasks", "work", "meetings", "routines", "personal"]
 
-async def check_reminders():
-    # Check for items starting in the next 10 minutes that haven't been alerted
-    now = datetime.now()
-    ten_mins_later = now + timedelta(minutes=10)
-    
-    now_str = now.strftime("%H:%M")
-    ten_mins_later_str = ten_mins_later.strftime("%H:%M")
-    today_str = now.strftime("%Y-%m-%d")
-    
-    for coll in activity_collections:
-        cursor = coll.find({
-            "date": today_str,
-            "status": "Pending",
-            "start_time": {"$gte": now_str, "$lte": ten_mins_later_str}
-        })
-        
-        async for task in cursor:
-            task_id = str(task["_id"])
-            user_id = task["user_id"]
-            
-            # Check if alert already sent
-            already_sent = await alerts_log_collection.find_one({
-                "task_id": task_id,
-                "user_id": user_id,
-                "method": "email"
-            })
-            
-            if not already_sent:
-                user = await users_collection.find_one({"_id": ObjectId(user_id)})
-                if user:
-                    subject = f"Reminder: {task['title']}"
-                    body = f"Your {task['category']} '{task['title']}' starts at {task['start_time']}."
-                    success = send_email(user["email"], subject, body)
-                    
-                    if success:
-                        await alerts_log_collection.insert_one({
-                            "user_id": user_id,
-                            "task_id": task_id,
-                            "alert_sent_at": datetime.utcnow(),
-                            "method": "email"
-                        })
+async def send_reminders(due: list):
+    # Called by the reminder engine with the reminders that just came due: [(task, method)].
+    # Constant round-trips however many are due: one re-read of the tasks, one alerts_log
+    # read, one users read, one insert_many claim and one outbox insert_many.
+    due = list({(str(task["_id"]), method): (task, method) for task, method in due}.values())
+    if not due:
+        return
 
-async def check_whatsapp_reminders():
-    # Check for items starting in exactly 20 minutes that haven't been alerted via WhatsApp
-    now = datetime.now()
-    twenty_mins_later = now + timedelta(minutes=20)
-    
-    twenty_mins_later_str = twenty_mins_later.strftime("%H:%M")
-    today_str = now.strftime("%Y-%m-%d")
-    
-    for coll in activity_collections:
-        cursor = coll.find({
-            "date": today_str,
-            "status": "Pending",
-            "start_time": twenty_mins_later_str
-        })
-        
-        async for task in cursor:
-            task_id = str(task["_id"])
-            user_id = task["user_id"]
-            
-            # Check if alert already sent for WhatsApp exactly
-            already_sent = await alerts_log_collection.find_one({
-                "task_id": task_id,
-                "user_id": user_id,
-                "method": "whatsapp"
-            })
-            
-            if not already_sent:
-                # Format the WhatsApp message
-                body = f"*Reminder*\nYour {task['category']} '{task['title']}' starts in 20 minutes at {task['start_time']}."
-                
-                # Target WhatsApp number
-                whatsapp_number = "whatsapp:+917013666788"
-                
-                success = send_whatsapp_message(whatsapp_number, body)
-                
-                if success:
-                    await alerts_log_collection.insert_one({
-                        "user_id": user_id,
-                        "task_id": task_id,
-                        "alert_sent_at": datetime.utcnow(),
-                        "method": "whatsapp"
-                    })
+    # The queued tasks are snapshots (another process may have edited them since the
+    # last resync): re-read them and drop reminders whose task moved or is no longer pending
+    fresh = {
+        str(task["_id"]): task
+        for task in await find_activities(
+            {"_id": {"$in": list({str(task["_id"]): task["_id"] for task, _ in due}.values())}},
+            activity_keys, reminders.REMINDER_FIELDS
+        )
+    }
+    stale = {
+        str(task["_id"]): task for task, _ in due
+        if not reminders.still_matches(task, fresh.get(str(task["_id"])))
+    }
+    if stale:
+        # Requeue them from what is stored now
+        reminders.note_changes([(task, None, fresh.get(task_id), None) for task_id, task in stale.items()])
+        print(f"DEBUG: Dropped {len(stale)} stale reminders")
+    due = [(fresh[str(task["_id"])], method) for task, method in due if str(task["_id"]) not in stale]
+
+    # Alerts already sent (another process or an earlier run)
+    already_sent = set()
+    async for row in alerts_log_collection.find(
+        {"task_id": {"$in": list({str(task["_id"]) for task, _ in due})}},
+        {"task_id": 1, "user_id": 1, "method": 1}
+    ):
+        already_sent.add((row["task_id"], row["user_id"], row["method"]))
+    due = [(task, method) for task, method in due if (str(task["_id"]), task["user_id"], method) not in already_sent]
+
+    user_ids = {task["user_id"] for task, method in due if method == "email"}
+    users = {}
+    if user_ids:
+        async for user in users_collection.find(
+            {"_id": {"$in": [ObjectId(user_id) for user_id in user_ids]}}, {"email": 1}
+        ):
+            users[str(user["_id"])] = user
+
+    jobs = []
+    for task, method in due:
+        if method == "email":
+            user = users.get(task["user_id"])
+            if not user:
+                continue
+            subject = f"Reminder: {task['title']}"
+            body = f"Your {task['category']} '{task['title']}' starts at {task['start_time']}."
+            jobs.append((task, method, email_job(user["email"], subject, body)))
+        else:
+            minutes = reminders.minutes_until(task)
+            body = f"*Reminder*\nYour {task['category']} '{task['title']}' starts in {minutes} minutes at {task['start_time']}."
+
+            # Target WhatsApp number
+            whatsapp_number = "whatsapp:+917013666788"
+
+            jobs.append((task, method, whatsapp_job(whatsapp_number, body)))
+    if not jobs:
+        return
+
+    # Claim before sending: the unique (task_id, user_id, method) index rejects
+    # reminders another process claimed since the read above. Ids are set here so the
+    # claims can be released if queueing fails.
+    claims = [
+        {"_id": ObjectId(), "user_id": task["user_id"], "task_id": str(task["_id"]),
+         "alert_sent_at": datetime.utcnow(), "method": method}
+        for task, method, _ in jobs
+    ]
+    lost = set()
+    try:
+        await alerts_log_collection.insert_many(claims, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            lost.add(error["index"])
+            if error.get("code") != 11000:
+                print(f"Reminder claim failed for task {claims[error['index']]['task_id']}: {error.get('errmsg')}")
+
+    # Queued durably - the outbox retries delivery, so the alert counts as sent
+    won = [i for i in range(len(jobs)) if i not in lost]
+    try:
+        await enqueue_many([jobs[i][2] for i in won])
+    except Exception as e:
+        # Release the claims so the reminders are not marked sent without being queued
+        await alerts_log_collection.delete_many({"_id": {"$in": [claims[i]["_id"] for i in won]}})
+        # and hand them back to the engine for its next pass
+        reminders.note_changes([(None, None, task, None) for task in {str(jobs[i][0]["_id"]): jobs[i][0] for i in won}.values()])
+        print(f"Reminder enqueue failed, released {len(won)} claims: {e}")
+        raise
 
 async def send_daily_summaries():
     # Send a summary of today's work at the end of the day
@@ -109,11 +114,7 @@ async def send_daily_summaries():
         user_id = str(user["_id"])
         
         # Aggregate from all collections
-        all_activities = []
-        for coll in activity_collections:
-            act_cursor = coll.find({"user_id": user_id, "date": today_str})
-            async for act in act_cursor:
-                all_activities.append(act)
+        all_activities = await find_activities({"user_id": user_id, "date": today_str}, activity_keys)
             
         completed = [a for a in all_activities if a["status"] == "Completed"]
         pending = [a for a in all_activities if a["status"] == "Pending"]
@@ -138,13 +139,13 @@ async def send_daily_summaries():
             body += "Keep up the great work!"
             whatsapp_body += "Keep up the great work!"
             
-            send_email(user["email"], subject, body)
-            send_whatsapp_message("whatsapp:+917013666788", whatsapp_body)
+            await enqueue_email(user["email"], subject, body)
+            await enqueue_whatsapp("whatsapp:+917013666788", whatsapp_body)
 
 def start_scheduler():
-    # misfire_grace_time allows the job to run even if missed by up to 60 seconds (useful for restarts)
-    scheduler.add_job(check_reminders, "interval", minutes=1, misfire_grace_time=60)
-    scheduler.add_job(check_whatsapp_reminders, "interval", minutes=1, misfire_grace_time=60)
+    # Reminders fire from the in-memory queue; the resync picks up writes from other processes
+    reminders.start(send_reminders)
+    scheduler.add_job(reminders.resync, "interval", minutes=reminders.REMINDER_RESYNC_MINUTES, misfire_grace_time=60)
     # Run daily summary at 9 PM
     scheduler.add_job(send_daily_summaries, "cron", hour=21, minute=0, misfire_grace_time=3600)
     if not scheduler.running:
@@ -0,0 +1,45 @@
+"""
+Per-user cache for the /stats endpoints.
+
+Entries are keyed by (user_id, endpoint, day, params) and dropped for a user as soon
+as the activity store writes any of that user's activities. The TTL only bounds
+staleness from writes handled by other worker processes.
+"""
+import os
+from datetime import datetime
+from services.cache import TTLCache
+
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "5000"))
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "60"))
+
+_cache = TTLCache(maxsize=STATS_CACHE_SIZE, ttl=STATS_CACHE_TTL)
+_user_keys = {}     # user_id -> keys cached for that user (some may have been evicted since)
+_generations = {}   # user_id -> number of invalidations so far
+
+
+async def cached(user_id: str, endpoint: str, params: tuple, compute):
+    """Return the cached result for this request or await `compute()` and store it."""
+    key = (user_id, endpoint, datetime.now().strftime("%Y-%m-%d"), params)
+    value = _cache.get(key)
+    if value is None:
+        generation = _generations.get(user_id, 0)
+        value = await compute()
+        # A write landed while computing: the value may already be stale, don't keep it
+        if _generations.get(user_id, 0) == generation:
+            _cache.set(key, value)
+            # Forget keys the LRU has evicted meanwhile, so the index stays small
+            keys = {k for k in _user_keys.get(user_id, ()) if k in _cache}
+            keys.add(key)
+            _user_keys[user_id] = keys
+    return value
+
+
+def invalidate_user(user_id: str):
+    """Drop the user's entries; costs O(that user's entries), not O(cache size)."""
+    _generations[user_id] = _generations.get(user_id, 0) + 1
+    for key in _user_keys.pop(user_id, ()):
+        _cache.pop(key)
+
+
+def cache_stats():
+    return _cache.stats()
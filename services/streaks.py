@@ -0,0 +1,71 @@
+"""
+Streak / consistency engine.
+
+Everything is computed in memory from the set of distinct dates on which the user
+completed at least one item, so results are exact for any length and the query
+cost does not depend on how long the streak is.
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from services.activity_store import activity_sources
+from services import rollups
+
+
+def parse_dates(values):
+    """Set of `date` objects from YYYY-MM-DD strings, silently skipping bad values."""
+    parsed = set()
+    for value in values:
+        try:
+            parsed.add(datetime.strptime(value, "%Y-%m-%d").date())
+        except (TypeError, ValueError):
+            continue
+    return parsed
+
+
+def current_streak(dates: set, today: date):
+    """
+    Consecutive completed days ending today. An unfinished today does not break
+    the streak - it is counted from yesterday instead.
+    """
+    day = today if today in dates else today - timedelta(days=1)
+    streak = 0
+    while day in dates:
+        streak += 1
+        day -= timedelta(days=1)
+    return streak
+
+
+def longest_streak(dates: set):
+    longest = 0
+    for day in dates:
+        # Only walk forward from the first day of each run
+        if day - timedelta(days=1) in dates:
+            continue
+        length = 1
+        while day + timedelta(days=length) in dates:
+            length += 1
+        longest = max(longest, length)
+    return longest
+
+
+def consistency(dates: set, start: date, end: date):
+    """Share of days in [start, end] with at least one completion, in percent."""
+    total_days = (end - start).days + 1
+    if total_days <= 0:
+        return 0.0
+    active_days = sum(1 for day in dates if start <= day <= end)
+    return active_days / total_days * 100
+
+
+async def completed_dates(user_id: str, keys):
+    """Distinct dates with a completed item in any of the given categories."""
+    if rollups.STATS_FROM_ROLLUPS:
+        rows = await rollups.fetch_rows(user_id, keys)
+        return parse_dates(row.get("date") for row in rows if row.get("completed", 0) > 0)
+
+    sources = activity_sources(keys)
+    results = await asyncio.gather(*(
+        coll.distinct("date", {**source_filter, "user_id": user_id, "status": "Completed"})
+        for coll, source_filter in sources
+    ))
+    return parse_dates(value for values in results for value in values)
@@ -0,0 +1,66 @@
+"""
+Maps an activity ObjectId to the split collection that owns it, so edits and
+deletes hit exactly one collection instead of probing all six.
+
+Backed by the `task_locator` collection ({_id: task ObjectId, key, user_id}) with
+an in-process LRU in front. Documents created before the locator existed are
+learned the first time they are found by a probe.
+"""
+import os
+from bson import ObjectId
+from pymongo import ReplaceOne
+from database import task_locator_collection
+from services.cache import TTLCache
+
+_cache = TTLCache(maxsize=int(os.getenv("LOCATOR_CACHE_SIZE", "10000")))
+
+
+async def remember(task_id: ObjectId, key: str, user_id: str):
+    _cache.set(task_id, (key, user_id))
+    await task_locator_collection.replace_one(
+        {"_id": task_id},
+        {"_id": task_id, "key": key, "user_id": user_id},
+        upsert=True
+    )
+
+
+async def remember_many(entries: list):
+    """Batch of (task_id, key, user_id) in one bulk write."""
+    if not entries:
+        return
+    for task_id, key, user_id in entries:
+        _cache.set(task_id, (key, user_id))
+    await task_locator_collection.bulk_write([
+        ReplaceOne({"_id": task_id}, {"_id": task_id, "key": key, "user_id": user_id}, upsert=True)
+        for task_id, key, user_id in entries
+    ], ordered=False)
+
+
+async def locate(task_id: ObjectId):
+    """(category key, owner user_id) of the collection holding `task_id`, or None when unknown."""
+    location = _cache.get(task_id)
+    if location:
+        return location
+    entry = await task_locator_collection.find_one({"_id": task_id})
+    if entry:
+        location = (entry["key"], entry.get("user_id"))
+        _cache.set(task_id, location)
+        return location
+    return None
+
+
+async def forget(task_id: ObjectId):
+    _cache.pop(task_id)
+    await task_locator_collection.delete_one({"_id": task_id})
+
+
+async def forget_many(task_ids: list):
+    if not task_ids:
+        return
+    for task_id in task_ids:
+        _cache.pop(task_id)
+    await task_locator_collection.delete_many({"_id": {"$in": list(task_ids)}})
+
+
+def cache_stats():
+    return _cache.stats()
@@ -0,0 +1,21 @@
+"""
+Fernet key for everything the app stores encrypted: vault passwords and
+sensitive outbox payloads. One instance per process, so a generated fallback
+key is at least shared by every module.
+"""
+import os
+from cryptography.fernet import Fernet
+from dotenv import load_dotenv
+
+load_dotenv()
+
+encryption_key = os.getenv("ENCRYPTION_KEY", Fernet.generate_key().decode()).strip()
+fernet = Fernet(encryption_key.encode())
+
+
+def encrypt(text: str):
+    return fernet.encrypt(text.encode()).decode()
+
+
+def decrypt(token: str):
+    return fernet.decrypt(token.encode()).decode()
@@ -0,0 +1,214 @@
+"""
+Async, rate-limited WhatsApp delivery through the Twilio REST API.
+
+- One keep-alive `httpx.AsyncClient` is reused for every request.
+- A token bucket holds sends to WHATSAPP_RATE_PER_SECOND (bursts up to WHATSAPP_BURST).
+- Messages to the same recipient that arrive within WHATSAPP_MERGE_WINDOW_MS are
+  merged into one (split again at Twilio's body limit).
+- Per-send latency and error counters are kept for /admin/metrics.
+
+The transport is pluggable: anything with `async send(to, body)` and `async close()`.
+TWILIO_API_BASE points the HTTP transport at a local fake for benchmarks.
+"""
+import os
+import time
+import asyncio
+from collections import deque
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+
+WHATSAPP_RATE_PER_SECOND = float(os.getenv("WHATSAPP_RATE_PER_SECOND", "10"))
+WHATSAPP_BURST = int(os.getenv("WHATSAPP_BURST", "10"))
+WHATSAPP_MERGE_WINDOW_MS = float(os.getenv("WHATSAPP_MERGE_WINDOW_MS", "1500"))
+WHATSAPP_TIMEOUT_SECONDS = float(os.getenv("WHATSAPP_TIMEOUT_SECONDS", "15"))
+
+# Twilio rejects message bodies longer than this
+MAX_BODY = 1600
+MERGE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` saved up. Event-loop only."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TwilioHTTPTransport:
+    """POSTs to the Messages resource over one pooled keep-alive client."""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str,
+                 api_base: str = TWILIO_API_BASE, timeout: float = WHATSAPP_TIMEOUT_SECONDS):
+        self.path = f"/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.from_number = from_number
+        self.client = httpx.AsyncClient(
+            base_url=api_base,
+            auth=(account_sid, auth_token),
+            timeout=timeout,
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+        )
+
+    async def send(self, to_number: str, body: str):
+        response = await self.client.post(self.path, data={"From": self.from_number, "To": to_number, "Body": body})
+        response.raise_for_status()
+        return response.json().get("sid")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def merge_bodies(texts: list, limit: int = MAX_BODY):
+    """
+    Join texts into as few bodies as possible, each at most `limit` characters.
+    Returns [(body, {indexes of the texts it carries})], so each text's result
+    depends only on the bodies it actually went out in.
+    """
+    bodies = []
+    for i, text in enumerate(texts):
+        while len(text) > limit:
+            bodies.append((text[:limit], {i}))
+            text = text[limit:]
+        if bodies and len(bodies[-1][0]) + len(MERGE_SEPARATOR) + len(text) <= limit:
+            body, owners = bodies[-1]
+            bodies[-1] = (body + MERGE_SEPARATOR + text, owners | {i})
+        else:
+            bodies.append((text, {i}))
+    return bodies
+
+
+class WhatsAppDispatcher:
+    def __init__(self, transport, rate: float = WHATSAPP_RATE_PER_SECOND, burst: int = WHATSAPP_BURST,
+                 merge_window_ms: float = WHATSAPP_MERGE_WINDOW_MS):
+        self.transport = transport
+        self.bucket = TokenBucket(rate, burst)
+        self.merge_window = merge_window_ms / 1000
+        self._pending = {}      # recipient -> [(text, future)]
+        self._flushes = set()
+        self.latencies = deque(maxlen=1000)
+        self.counters = {"requested": 0, "sent": 0, "merged": 0, "errors": 0}
+
+    def submit(self, to_number: str, text: str):
+        """
+        Queue `text` for `to_number` and return straight away. The future resolves to
+        True once the body carrying it was delivered (possibly merged), else False.
+        """
+        if not to_number.startswith("whatsapp:"):
+            to_number = f"whatsapp:{to_number}"
+        self.counters["requested"] += 1
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(to_number, [])
+        batch.append((text, future))
+        if len(batch) == 1:
+            flush = asyncio.create_task(self._flush_later(to_number))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        return future
+
+    async def send(self, to_number: str, text: str):
+        return await self.submit(to_number, text)
+
+    async def _flush_later(self, to_number: str):
+        await asyncio.sleep(self.merge_window)
+        await self._flush(to_number)
+
+    async def _flush(self, to_number: str):
+        batch = self._pending.pop(to_number, [])
+        if not batch:
+            return
+        bodies = merge_bodies([text for text, _ in batch])
+        self.counters["merged"] += max(len(batch) - len(bodies), 0)
+        failed = set()
+        for body, owners in bodies:
+            await self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                await self.transport.send(to_number, body)
+                self.counters["sent"] += 1
+            except Exception as e:
+                # Only the texts carried by this body failed
+                failed |= owners
+                self.counters["errors"] += 1
+                print(f"WhatsApp send to {to_number} failed: {e}")
+            finally:
+                self.latencies.append((time.perf_counter() - start) * 1000)
+        for i, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(i not in failed)
+
+    async def close(self):
+        """Deliver everything still waiting for its merge window, then close the transport."""
+        await asyncio.gather(*(self._flush(to_number) for to_number in list(self._pending)))
+        for flush in list(self._flushes):
+            flush.cancel()
+        await self.transport.close()
+
+    def stats(self):
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)], 1) if ordered else 0.0
+
+        return {
+            **self.counters,
+            "waiting": sum(len(batch) for batch in self._pending.values()),
+            "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": round(ordered[-1], 1) if ordered else 0.0},
+        }
+
+
+_dispatcher = None
+
+
+def get_dispatcher():
+    """Shared dispatcher for this process, or None when Twilio is not configured."""
+    global _dispatcher
+    if _dispatcher is None and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+        _dispatcher = WhatsAppDispatcher(TwilioHTTPTransport(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER))
+    return _dispatcher
+
+
+def submit_whatsapp(to_number: str, text: str):
+    """Hand a message to the shared dispatcher. Returns a future with the delivery result."""
+    dispatcher = get_dispatcher()
+    if not dispatcher:
+        print("Twilio Client is not configured. Could not send WhatsApp message.")
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(False)
+        return future
+    return dispatcher.submit(to_number, text)
+
+
+async def send_whatsapp_async(to_number: str, text: str):
+    return await submit_whatsapp(to_number, text)
+
+
+def dispatcher_stats():
+    return _dispatcher.stats() if _dispatcher else {"configured": bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)}
+
+
+async def close_dispatcher():
+    global _dispatcher
+    if _dispatcher:
+        await _dispatcher.close()
+        _dispatcher = None